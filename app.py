@@ -2,15 +2,32 @@ import os
 import sys
 import requests
 import json
-from flask import Flask, render_template_string, request, redirect, url_for, Response, jsonify, flash
-from pymongo import MongoClient
+import base64
+from flask import Flask, request, redirect, url_for, Response, jsonify, flash, make_response
+from pymongo import MongoClient, TEXT, InsertOne, UpdateOne, monitoring
+from pymongo.errors import ExecutionTimeout, DuplicateKeyError, BulkWriteError, OperationFailure
 from bson.objectid import ObjectId
+from bson import json_util, encode as encode_bson, decode as decode_bson
 from functools import wraps
-from urllib.parse import unquote, quote
+from itertools import groupby, takewhile
+from urllib.parse import unquote, quote, urlencode, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from datetime import datetime
 import math
 import re
 import logging
+import time
+import threading
+from collections import OrderedDict, Counter, deque
+import atexit
+import hashlib
+import html
+import mimetypes
+import sqlite3
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 # Vercel এ লগিং সেটআপ
 logging.basicConfig(level=logging.ERROR)
@@ -40,32 +57,352 @@ ITEMS_PER_PAGE = 20
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "a_super_secret_key_for_flash_messages")
 
 
+# =====================================================================
+# === [INSTRUMENTATION] ===============================================
+# =====================================================================
+
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") == "1"
+REQUEST_LOG = os.environ.get("REQUEST_LOG", "1") == "1"  # one JSON line per request on stdout
+METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", 1000))  # latencies kept per route
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 0))  # 0 disables slow-request profiles
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/profiles")
+
+request_log = logging.getLogger("request_log")
+request_log.setLevel(logging.INFO); request_log.propagate = False
+_request_log_handler = logging.StreamHandler(sys.stdout); _request_log_handler.setFormatter(logging.Formatter("%(message)s"))
+request_log.addHandler(_request_log_handler)
+
+def percentile_ms(window, q):
+    """q-quantile of a sorted list of seconds, in ms."""
+    return round(window[min(int(len(window) * q), len(window) - 1)] * 1000, 1) if window else None
+
+class RequestTimings:
+    """Time spent per phase (db/render/http) within the current request, kept in a thread-local."""
+    _local = threading.local()
+
+    def __init__(self): self.started = time.perf_counter(); self.phases = {}; self.counts = Counter()
+
+    @classmethod
+    def begin(cls): cls._local.current = cls(); return cls._local.current
+
+    @classmethod
+    def end(cls): timings = getattr(cls._local, "current", None); cls._local.current = None; return timings
+
+    @classmethod
+    def observe(cls, phase, seconds):
+        timings = getattr(cls._local, "current", None)
+        if timings is not None:
+            timings.phases[phase] = timings.phases.get(phase, 0.0) + seconds; timings.counts[phase] += 1
+
+    @classmethod
+    def timed(cls, phase):
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                start = time.perf_counter()
+                try: return f(*args, **kwargs)
+                finally: cls.observe(phase, time.perf_counter() - start)
+            return decorated
+        return decorator
+
+    def server_timing(self, total):
+        parts = [f'{phase};dur={seconds * 1000:.1f};desc="{self.counts[phase]} calls"' for phase, seconds in self.phases.items()]
+        return ", ".join(parts + [f"total;dur={total * 1000:.1f}"])
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Attributes every driver command to the request running on the calling thread, plus process-wide totals per command."""
+    def __init__(self): self.commands = Counter(); self.failures = Counter(); self.micros = Counter()
+
+    def started(self, event): pass
+
+    def succeeded(self, event):
+        self.commands[event.command_name] += 1; self.micros[event.command_name] += event.duration_micros
+        RequestTimings.observe("db", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.failures[event.command_name] += 1; self.micros[event.command_name] += event.duration_micros
+        RequestTimings.observe("db", event.duration_micros / 1e6)
+
+    def stats(self):
+        return {name: {"count": count, "failures": self.failures[name], "avg_ms": round(self.micros[name] / count / 1000, 2)}
+                for name, count in self.commands.most_common()}
+
+mongo_command_timer = MongoCommandTimer()
+
+
+class RouteMetrics:
+    """Rolling latency window and status counts per URL rule."""
+    def __init__(self, window=METRICS_WINDOW): self.window = window; self._routes = {}; self._lock = threading.Lock()
+
+    def record(self, route, seconds, status):
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is None: entry = self._routes[route] = {"latencies": deque(maxlen=self.window), "requests": 0, "errors": 0}
+            entry["latencies"].append(seconds); entry["requests"] += 1
+            if status >= 500: entry["errors"] += 1
+
+    def stats(self):
+        with self._lock: routes = {route: (sorted(e["latencies"]), e["requests"], e["errors"]) for route, e in self._routes.items()}
+        return {route: {"requests": requests_, "errors": errors, "p50_ms": percentile_ms(window, 0.5), "p95_ms": percentile_ms(window, 0.95), "p99_ms": percentile_ms(window, 0.99)}
+                for route, (window, requests_, errors) in sorted(routes.items())}
+
+route_metrics = RouteMetrics()
+
+
+class SlowRequestProfiler:
+    """Sampling profiler for request threads: one daemon thread snapshots their stacks every PROFILE_INTERVAL,
+    and requests slower than PROFILE_SLOW_MS dump the collapsed stacks (flamegraph.pl / speedscope format)."""
+    def __init__(self, interval=PROFILE_INTERVAL, directory=PROFILE_DIR):
+        self.interval = interval; self.directory = directory
+        self._active = {}; self._lock = threading.Lock(); self._thread = None; self.dumps = 0
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True); self._thread.start()
+
+    def end(self):
+        with self._lock: return self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock: active = dict(self._active)
+            if not active: continue
+            frames = sys._current_frames()
+            for ident, samples in active.items():
+                frame = frames.get(ident); stack = []
+                while frame is not None and len(stack) < 64:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"); frame = frame.f_back
+                if stack: samples[";".join(reversed(stack))] += 1
+
+    def dump(self, samples, route, seconds):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'}-{int(seconds * 1000)}ms.txt"
+            with open(os.path.join(self.directory, name), "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+            self.dumps += 1
+        except OSError as e: app.logger.error(f"Profile dump failed: {e}")
+
+slow_request_profiler = SlowRequestProfiler() if PROFILE_SLOW_MS > 0 else None
+
+@app.before_request
+def start_request_timings():
+    RequestTimings.begin()
+    if slow_request_profiler: slow_request_profiler.begin()
+
+@app.after_request
+def finish_request_timings(response):
+    timings = RequestTimings.end()
+    samples = slow_request_profiler.end() if slow_request_profiler else None
+    if timings is None: return response
+    total = time.perf_counter() - timings.started
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    route_metrics.record(route, total, response.status_code)
+    if SERVER_TIMING: response.headers['Server-Timing'] = timings.server_timing(total)
+    if REQUEST_LOG:
+        request_log.info(json.dumps({"ts": datetime.utcnow().isoformat() + "Z", "method": request.method, "route": route, "path": request.path,
+                                     "status": response.status_code, "ms": round(total * 1000, 1),
+                                     **{f"{phase}_ms": round(seconds * 1000, 1) for phase, seconds in timings.phases.items()},
+                                     **{f"{phase}_calls": count for phase, count in timings.counts.items()}}))
+    if samples and total * 1000 >= PROFILE_SLOW_MS: slow_request_profiler.dump(samples, route, total)
+    return response
+
+
 # =====================================================================
 # === [DB SETUP, AUTH & HELPERS] ======================================
 # =====================================================================
 
-# --- Database Connection (Protected) ---
-movies, settings, categories_collection, requests_collection, ott_collection = None, None, None, None, None
+# --- Database Connection (lazy, fork-safe) ---
+MONGO_DB_NAME = os.environ.get("MONGO_DB_NAME", "movie_db")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 10))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_MS = int(os.environ.get("MONGO_MAX_IDLE_MS", 60000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000))
+
+_mongo_client, _mongo_client_pid = None, None
+_mongo_client_lock = threading.Lock()
+
+def get_mongo_client():
+    """Created on first use (no SRV lookup or handshake at import) and reused across warm invocations.
+    A forked child (different pid) builds its own client instead of sharing the parent's sockets."""
+    global _mongo_client, _mongo_client_pid
+    if _mongo_client is None or _mongo_client_pid != os.getpid():
+        with _mongo_client_lock:
+            if _mongo_client is None or _mongo_client_pid != os.getpid():
+                _mongo_client = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE,
+                                            maxIdleTimeMS=MONGO_MAX_IDLE_MS, serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                                            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS, connect=False,
+                                            event_listeners=[mongo_command_timer])
+                _mongo_client_pid = os.getpid()
+    return _mongo_client
+
+def get_db(): return get_mongo_client()[MONGO_DB_NAME]
+
+class LazyCollection:
+    """Module-level stand-in for a pymongo Collection; resolves the client on first attribute access."""
+    def __init__(self, name): self._name = name; self._collection = None; self._pid = None
+
+    @property
+    def name(self): return self._name
+
+    def resolve(self):
+        if self._collection is None or self._pid != os.getpid():
+            self._collection = get_db()[self._name]; self._pid = os.getpid()
+        return self._collection
+
+    def __getattr__(self, attr): return getattr(self.resolve(), attr)
+
+movies = LazyCollection("movies")
+settings = LazyCollection("settings")
+categories_collection = LazyCollection("categories")
+requests_collection = LazyCollection("requests")
+ott_collection = LazyCollection("ott_platforms")
+jobs_collection = LazyCollection("jobs")
+ingest_dedup_collection = LazyCollection("ingest_dedup")
+tmdb_cache_collection = LazyCollection("tmdb_cache")
+outbox_collection = LazyCollection("notification_outbox")
+home_snapshot_collection = LazyCollection("home_snapshot")
+view_buckets_collection = LazyCollection("view_buckets")
+rankings_collection = LazyCollection("rankings")
+resolved_files_collection = LazyCollection("resolved_files")
+
+# --- Index Manager ---
+def index_name(keys): return "_".join(f"{field}_{direction}" for field, direction in keys)  # MongoDB's default naming
+
+# Every query shape the routes/jobs issue, declared once; verify_query_plans() explains them via query_shapes().
+INDEX_SPECS = {
+    "movies": [
+        {"keys": [("updated_at", -1), ("_id", -1)]},                     # slider, unfiltered keyset pages
+        {"keys": [("created_at", -1)]},                                  # "Latest Streams" shelf
+        {"keys": [("type", 1), ("updated_at", -1), ("_id", -1)]},        # /movies, /series
+        {"keys": [("categories", 1), ("updated_at", -1), ("_id", -1)]},  # category shelves, /category
+        # language_override points at an unused field: our own `language` values ("Bangla/Hindi") are not Mongo text languages.
+        {"keys": [("title", TEXT), ("overview", TEXT), ("genres", TEXT), ("language", TEXT)], "name": "movie_text_search",
+         "weights": {"title": 10, "genres": 3, "language": 3, "overview": 1}, "default_language": "none", "language_override": "text_language"},
+        {"keys": [("enrichment.status", 1)], "partialFilterExpression": {"enrichment.status": "pending"}},
+        {"keys": [("series_key", 1)], "unique": True, "partialFilterExpression": {"series_key": {"$exists": True}}},
+        {"keys": [("ingest_key", 1)], "unique": True, "partialFilterExpression": {"ingest_key": {"$exists": True}}},  # webhook upsert
+        {"keys": [("title", 1)]},                                        # search fallback (anchored title prefix)
+        {"keys": [("tmdb_id", 1)]},                                      # catalogue import upserts
+        {"keys": [("links.file_unique_id", 1)]},                         # catalogue import upserts (untagged movies)
+    ],
+    "requests": [{"keys": [("status", 1), ("created_at", -1)]}],
+    "jobs": [{"keys": [("status", 1), ("run_at", 1)]},
+             {"keys": [("finished_at", 1)], "expireAfterSeconds": int(os.environ.get("JOB_RETENTION", 7 * 86400))}],  # only done/dead jobs carry finished_at
+    "ingest_dedup": [{"keys": [("created_at", 1)], "expireAfterSeconds": int(os.environ.get("INGEST_DEDUP_TTL", 30 * 86400))}],
+    "tmdb_cache": [{"keys": [("expires_at", 1)], "expireAfterSeconds": 0}],
+    "notification_outbox": [{"keys": [("chat_id", 1), ("status", 1), ("created_at", 1)]},
+                            {"keys": [("finished_at", 1)], "expireAfterSeconds": int(os.environ.get("NOTIFY_RETENTION", 30 * 86400))}],  # sent/failed only
+    "view_buckets": [{"keys": [("hour", 1)], "expireAfterSeconds": 8 * 86400}],
+    "resolved_files": [{"keys": [("expires_at", 1)], "expireAfterSeconds": 0}],
+}
+INDEX_COMPARED_OPTIONS = ("unique", "partialFilterExpression", "expireAfterSeconds", "weights", "default_language", "language_override")
+
+def _index_matches(existing, spec):
+    if not any(direction == TEXT for _, direction in spec['keys']):
+        if [(field, int(direction)) for field, direction in existing['key']] != [(field, int(direction)) for field, direction in spec['keys']]: return False
+    return all(existing.get(option) == spec.get(option) for option in INDEX_COMPARED_OPTIONS if option in spec or option in existing)
+
+def sync_indexes(prune=False):
+    """Idempotently reconcile INDEX_SPECS with the database: create missing, rebuild changed,
+    and (with prune) drop undeclared ones such as the old single-field title/type indexes."""
+    report = []
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = get_db()[collection_name]
+        existing = collection.index_information()
+        declared = set()
+        for spec in specs:
+            name = spec.get('name') or index_name(spec['keys']); declared.add(name)
+            options = {k: v for k, v in spec.items() if k not in ("keys", "name")}
+            if name in existing and _index_matches(existing[name], spec):
+                report.append((collection_name, name, "ok")); continue
+            action = "created"
+            if name in existing: collection.drop_index(name); action = "rebuilt"
+            collection.create_index(spec['keys'], name=name, **options)
+            report.append((collection_name, name, action))
+        for name in existing:
+            if name != "_id_" and name not in declared:
+                if prune: collection.drop_index(name)
+                report.append((collection_name, name, "dropped" if prune else "undeclared"))
+    return report
+
+def query_shapes():
+    """(label, collection, query) for every hot path, built by the same functions the routes and jobs call.
+    query is {"filter", "sort", "limit"} for a find or {"pipeline"} for an aggregate; "allow" lists stages that are
+    inherent to the shape (a textScore sort is always in memory)."""
+    at, oid = datetime(2024, 1, 1), ObjectId("6590000000000000000000ff")
+    def listing(label, query_filter, cursor=None):
+        seek_filter, sort = keyset_query(query_filter, cursor)
+        return (label, "movies", {"filter": seek_filter, "sort": sort, "limit": ITEMS_PER_PAGE})
+    text_filter, _, text_sort = search_text_query("love")
+    fallback_filter, _, fallback_sort = search_fallback_query("lov")
+    claim_filter, claim_sort = MongoJobQueue.claim_query(at)
+    outbox_filter, outbox_sort = NotificationDispatcher.pending_query("@channel")
+    return [
+        ("home shelves", "movies", {"pipeline": home_pipeline(["Trending", "Action"])}),
+        listing("/movies", {"type": "movie"}), listing("/series", {"type": "series"}), listing("/category", {"categories": "Action"}),
+        listing("/movies next page", {"type": "movie"}, {"updated_at": at, "_id": oid, "forward": True}),
+        listing("/category prev page", {"categories": "Action"}, {"updated_at": at, "_id": oid, "forward": False}),
+        ("text search", "movies", {"filter": text_filter, "sort": text_sort, "limit": ITEMS_PER_PAGE, "allow": {"SORT"}}),
+        ("search fallback", "movies", {"filter": fallback_filter, "sort": fallback_sort, "limit": ITEMS_PER_PAGE}),
+        ("enrichment backlog", "movies", {"filter": {"enrichment.status": "pending"}, "limit": 500}),
+        ("series_key lookup", "movies", {"filter": {"series_key": series_key_for("Example Series")}, "limit": 1}),
+        ("webhook upsert by ingest_key", "movies", {"filter": {"ingest_key": "AgAD"}, "limit": 1}),
+        ("import upsert by tmdb_id", "movies", {"filter": catalogue_upsert_filter({"tmdb_id": 550, "type": "movie"}), "limit": 1}),
+        ("import upsert by file", "movies", {"filter": catalogue_upsert_filter({"links": [{"file_unique_id": "AgAD"}]}), "limit": 1}),
+        ("job claim", "jobs", {"filter": claim_filter, "sort": claim_sort, "limit": 1}),
+        ("job reap", "jobs", {"filter": MongoJobQueue.reap_filter(at), "limit": 1}),
+        ("outbox pending scan", "notification_outbox", {"filter": outbox_filter, "sort": outbox_sort, "limit": 10}),
+    ]
+
+EXPLAIN_SKIPPED_KEYS = ("rejectedPlans", "command", "parsedQuery", "serverInfo", "serverParameters")
+
+def _plan_stages(node):
+    """Every stage of an explain() result, find or aggregate ($unionWith sub-pipelines included); a $sort
+    the aggregation could not push into the query layer counts as SORT."""
+    stages = []
+    if isinstance(node, list):
+        for item in node: stages += _plan_stages(item)
+    elif isinstance(node, dict):
+        if isinstance(node.get('stage'), str): stages.append(node['stage'])
+        if '$sort' in node: stages.append('SORT')
+        for key, value in node.items():
+            if key not in EXPLAIN_SKIPPED_KEYS: stages += _plan_stages(value)
+    return stages
+
+def explain_query_shape(collection_name, query):
+    """(ok, stages): ok unless the winning plan has a COLLSCAN or in-memory SORT not listed in query["allow"]."""
+    if "pipeline" in query:
+        explained = get_db().command("aggregate", collection_name, pipeline=query["pipeline"], explain=True)
+    else:
+        cursor = get_db()[collection_name].find(query["filter"]).limit(query.get("limit", 0))
+        if query.get("sort"): cursor = cursor.sort(query["sort"])
+        explained = cursor.explain()
+    stages = _plan_stages(explained)
+    return not ({"COLLSCAN", "SORT"} - query.get("allow", set())) & set(stages), stages
+
+def verify_query_plans():
+    """explain() every query_shapes() entry against the live indexes."""
+    return [(label, *explain_query_shape(collection_name, query)) for label, collection_name, query in query_shapes()]
 
-try:
-    client = MongoClient(MONGO_URI)
-    db = client["movie_db"]
-    movies = db["movies"]
-    settings = db["settings"]
-    categories_collection = db["categories"]
-    requests_collection = db["requests"]
-    ott_collection = db["ott_platforms"]
-    print("SUCCESS: Successfully connected to MongoDB!")
+SCHEMA_VERSION_ID = "schema_version"
+INDEX_SPECS_VERSION = hashlib.sha1(json.dumps(INDEX_SPECS, sort_keys=True, default=str).encode()).hexdigest()[:12]
 
+def run_migrations():
+    """Seed + index setup (python app.py migrate, /admin/migrate, or the `migrate` job a fresh deploy queues itself)."""
     if categories_collection.count_documents({}) == 0:
         default_categories = ["Trending", "Bangla", "Hindi", "English", "Series", "Action", "Romance"]
         categories_collection.insert_many([{"name": cat} for cat in default_categories])
-    
-    movies.create_index("title")
-    movies.create_index("type")
-    
-except Exception as e:
-    app.logger.error(f"FATAL: Error connecting to MongoDB: {e}.")
+    report = sync_indexes()
+    settings.update_one({"_id": SCHEMA_VERSION_ID}, {"$set": {"indexes": INDEX_SPECS_VERSION, "migrated_at": datetime.utcnow()}}, upsert=True)
+    print("SUCCESS: Migrations applied.")
+    return report
 
 
 # --- Authentication (standard) ---
@@ -79,6 +416,137 @@ def requires_auth(f):
         return f(*args, **kwargs)
     return decorated
 
+# --- Outbound HTTP (pooled, keep-alive) ---
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 10))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 2))
+HTTP_MAX_RETRY_WAIT = float(os.environ.get("HTTP_MAX_RETRY_WAIT", 10))
+HTTP_BREAKER_THRESHOLD = int(os.environ.get("HTTP_BREAKER_THRESHOLD", 5))
+HTTP_BREAKER_COOLDOWN = float(os.environ.get("HTTP_BREAKER_COOLDOWN", 30))
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+class HostClient:
+    """One keep-alive Session per upstream host, with its own circuit breaker and latency window."""
+    def __init__(self, host, pool_size=10):
+        self.host = host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter); self.session.mount("http://", adapter)
+        self.consecutive_failures = 0; self.opened_at = None; self.probing = False
+        self.requests = 0; self.errors = 0; self.retries = 0; self.latencies = deque(maxlen=500)
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None: return True
+            if self.probing or time.monotonic() - self.opened_at < HTTP_BREAKER_COOLDOWN: return False
+            self.probing = True  # half-open: exactly one trial request until it records its outcome
+            return True
+
+    def record(self, elapsed, ok):
+        with self._lock:
+            self.requests += 1; self.latencies.append(elapsed); self.probing = False
+            if ok: self.consecutive_failures = 0; self.opened_at = None
+            else:
+                self.errors += 1; self.consecutive_failures += 1
+                if self.consecutive_failures >= HTTP_BREAKER_THRESHOLD: self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock: window = sorted(self.latencies)
+        return {"requests": self.requests, "errors": self.errors, "retries": self.retries, "p50_ms": percentile_ms(window, 0.5), "p99_ms": percentile_ms(window, 0.99),
+                "circuit": "closed" if self.opened_at is None else "half-open" if self.probing else "open"}
+
+
+class OutboundHTTP:
+    """Shared client for Telegram/TMDB calls: pooled sessions, (connect, read) timeouts,
+    jittered retries on 429/5xx honoring Retry-After / Telegram's parameters.retry_after,
+    and a per-host circuit breaker. POSTs are only retried when the request provably was not processed
+    (429, or a connect-phase failure), so a channel post is never sent twice."""
+    IDEMPOTENT = {"GET", "HEAD", "OPTIONS"}
+
+    def __init__(self): self._hosts = {}; self._lock = threading.Lock()
+
+    def client(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts: self._hosts[host] = HostClient(host)
+            return self._hosts[host]
+
+    @staticmethod
+    def _retry_after(res):
+        try: return float(res.json().get('parameters', {}).get('retry_after'))
+        except Exception: pass
+        try: return float(res.headers.get('Retry-After'))
+        except (TypeError, ValueError): return None
+
+    @staticmethod
+    def _never_sent(e):
+        """Connect-phase failures only; a reset after the request went out may still have been processed."""
+        if isinstance(e, requests.ConnectTimeout): return True
+        reason = getattr(e.args[0], 'reason', None) if isinstance(e, requests.ConnectionError) and e.args else None
+        return isinstance(reason, NewConnectionError)
+
+    @staticmethod
+    def _backoff(attempt): return min(0.5 * 2 ** attempt, HTTP_MAX_RETRY_WAIT) * random.uniform(0.5, 1.0)
+
+    def request(self, method, url, timeout=None, retries=HTTP_MAX_RETRIES, **kwargs):
+        method = method.upper(); host = self.client(url)
+        if not host.allow(): raise CircuitOpenError(f"Circuit open for {host.host}")
+        idempotent = method in self.IDEMPOTENT
+        for attempt in range(retries + 1):
+            start = time.perf_counter(); last_try = attempt == retries
+            try:
+                res = host.session.request(method, url, timeout=(HTTP_CONNECT_TIMEOUT, timeout or HTTP_READ_TIMEOUT), **kwargs)
+            except requests.RequestException as e:
+                RequestTimings.observe("http", time.perf_counter() - start)
+                host.record(time.perf_counter() - start, ok=False)
+                if last_try or not (idempotent or self._never_sent(e)): raise
+                host.retries += 1; time.sleep(self._backoff(attempt)); continue
+            retryable = res.status_code == 429 or (res.status_code >= 500 and idempotent)
+            RequestTimings.observe("http", time.perf_counter() - start)
+            host.record(time.perf_counter() - start, ok=res.status_code < 500 and res.status_code != 429)
+            if not retryable or last_try: return res
+            wait = self._retry_after(res) or self._backoff(attempt)
+            if wait > HTTP_MAX_RETRY_WAIT: return res
+            res.close()  # hand the pooled connection back; matters for stream=True responses that are never read
+            host.retries += 1; time.sleep(wait)
+        return res
+
+    def get(self, url, **kwargs): return self.request("GET", url, **kwargs)
+    def post(self, url, **kwargs): return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self._lock: hosts = dict(self._hosts)
+        return {name: host.stats() for name, host in hosts.items()}
+
+http_client = OutboundHTTP()
+
+
+class TokenBucket:
+    """Thread-safe rate limiter: `rate` tokens/second, bursts up to `capacity`."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate; self.capacity = capacity or rate
+        self._tokens = self.capacity; self._updated = time.monotonic(); self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate); self._updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available; otherwise return the seconds until one will be."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1: self._tokens -= 1; return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait: return
+            time.sleep(wait)
+
+
 # --- Helper Functions (standard) ---
 def format_series_info(episodes, season_packs):
     info_parts = []
@@ -95,40 +563,390 @@ def format_series_info(episodes, season_packs):
             info_parts.append(f"S{season:02d} [{ep_range} ADDED]")
     return " & ".join(info_parts)
 
-def send_telegram_notification(movie_data, content_id, notification_type='new', series_update_info=None):
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHANNEL_ID or not WEBSITE_URL: return
-    try:
-        movie_url = f"{WEBSITE_URL}/movie/{str(content_id)}"
-        title_with_year = movie_data.get('title', 'N/A')
-        quality_str = "WEB-DL"; language_str = movie_data.get('language', 'N/A')
-        genres_str = ", ".join(movie_data.get('genres', [])) if movie_data.get('genres') else "N/A"
-        clean_url = WEBSITE_URL.replace('https://', '').replace('www.', '')
-        
-        caption_header = f"🔥 **NEW STREAM : {title_with_year}**\n"
-        caption = caption_header
-        caption += f"\n🌐 Language: **{language_str}**"
-        caption += f"\n🎭 Genres: **{genres_str}**"
-        caption += f"\n\n🔗 Visit : **{clean_url}**"
-
-        inline_keyboard = {"inline_keyboard": [[{"text": "▶️ Watch Now", "url": movie_url}]]}
-        api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
-        payload = {'chat_id': TELEGRAM_CHANNEL_ID, 'photo': movie_data.get('poster', PLACEHOLDER_POSTER), 'caption': caption, 'parse_mode': 'Markdown', 'reply_markup': json.dumps(inline_keyboard)}
-        
-        requests.post(api_url, data=payload, timeout=15).raise_for_status()
-    except Exception as e:
-        app.logger.error(f"ERROR: Failed to send Telegram notification: {e}")
+def build_telegram_notification(movie_data, content_id, notification_type='new', series_update_info=None):
+    """Photo + HTML caption + watch URL for a channel post (shared by single posts and digests).
+    Every value is escaped: raw upload titles would otherwise break Telegram's entity parsing."""
+    movie_url = f"{WEBSITE_URL}/movie/{str(content_id)}"
+    title_with_year = html.escape(movie_data.get('title', 'N/A'))
+    quality_str = "WEB-DL"; language_str = html.escape(movie_data.get('language', 'N/A'))
+    genres_str = html.escape(", ".join(movie_data.get('genres', []))) if movie_data.get('genres') else "N/A"
+    clean_url = html.escape(WEBSITE_URL.replace('https://', '').replace('www.', ''))
+    
+    caption_header = f"🔥 <b>NEW STREAM : {title_with_year}</b>\n"
+    if notification_type == 'update' and series_update_info:
+        caption_header = f"📺 <b>NEW EPISODES : {title_with_year}</b>\n\n✨ <b>{html.escape(series_update_info)}</b>\n"
+    caption = caption_header
+    caption += f"\n🌐 Language: <b>{language_str}</b>"
+    caption += f"\n🎭 Genres: <b>{genres_str}</b>"
+    caption += f"\n\n🔗 Visit : <b>{clean_url}</b>"
+    return {"photo": movie_data.get('poster') or PLACEHOLDER_POSTER, "caption": caption, "url": movie_url}
+
+def get_telegram_file_path(file_id):
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getFile"
+    res = http_client.get(url, params={'file_id': file_id}, timeout=5)
+    res.raise_for_status()
+    file_path = res.json().get('result', {}).get('file_path')
+    if not file_path: raise RuntimeError(f"getFile returned no file_path for {file_id}")
+    return file_path
+
+# --- TMDB Metadata (cached) ---
+TMDB_FRESH_TTL = int(os.environ.get("TMDB_FRESH_TTL", 7 * 86400))
+TMDB_STALE_TTL = int(os.environ.get("TMDB_STALE_TTL", 30 * 86400))
+TMDB_NEGATIVE_TTL = int(os.environ.get("TMDB_NEGATIVE_TTL", 86400))
+TMDB_RATE_LIMIT = float(os.environ.get("TMDB_RATE_LIMIT", 40))
+tmdb_rate_limiter = TokenBucket(TMDB_RATE_LIMIT)
+
+def _tmdb_cache_key(tmdb_id, media_type): return f"{'tv' if media_type == 'series' else 'movie'}:{tmdb_id}"
+
+def fetch_tmdb_details(tmdb_id, media_type):
+    """Live TMDB lookup. Returns None on 404, raises requests.RequestException on other failures."""
+    search_type = "tv" if media_type == "series" else "movie"
+    tmdb_rate_limiter.acquire()
+    detail_url = f"https://api.themoviedb.org/3/{search_type}/{tmdb_id}?api_key={TMDB_API_KEY}"
+    res = http_client.get(detail_url, timeout=10)
+    if res.status_code == 404: return None
+    res.raise_for_status()
+    data = res.json()
+    details = { "tmdb_id": tmdb_id, "title": data.get("title") or data.get("name"), "poster": f"https://image.tmdb.org/t/p/w500{data.get('poster_path')}" if data.get('poster_path') else None, "backdrop": f"https://image.tmdb.org/t/p/w1280{data.get('backdrop_path')}" if data.get('backdrop_path') else None, "overview": data.get("overview"), "release_date": data.get("release_date") or data.get("first_air_date"), "genres": [g['name'] for g in data.get("genres", [])], "vote_average": data.get("vote_average"), "type": "series" if search_type == "tv" else "movie", "original_language": data.get("original_language") }
+    return details
+
+def _tmdb_cache_doc(key, details):
+    now = datetime.utcnow()
+    ttl = TMDB_STALE_TTL if details else TMDB_NEGATIVE_TTL
+    return {"_id": key, "status": "ok" if details else "not_found", "data": details, "fetched_at": now, "expires_at": now + timedelta(seconds=ttl)}
+
+def store_tmdb_details(tmdb_id, media_type, details):
+    key = _tmdb_cache_key(tmdb_id, media_type)
+    tmdb_cache_collection.replace_one({"_id": key}, _tmdb_cache_doc(key, details), upsert=True)
+
+# --- Stream Link Resolver ---
+TELEGRAM_FILE_PATH_TTL = int(os.environ.get("TELEGRAM_FILE_PATH_TTL", 3000))  # Telegram guarantees file links for >= 1 hour
+
+class StreamLinkResolver:
+    """file_id -> Telegram file_path, resolved lazily at watch time; only StreamProxy turns it into a bot-token URL.
+    Layers: in-process TTL cache -> shared `resolved_files` collection -> getFile. Concurrent
+    misses for the same file_id are single-flighted so a rush of viewers costs one getFile."""
+    def __init__(self, ttl=TELEGRAM_FILE_PATH_TTL, max_size=2048):
+        self.ttl = ttl; self.max_size = max_size
+        self._local = OrderedDict(); self._inflight = {}; self._lock = threading.Lock()
+        self.hits = 0; self.shared_hits = 0; self.fetches = 0; self.coalesced = 0
+
+    def _cached(self, file_id):
+        with self._lock:
+            entry = self._local.get(file_id)
+            if entry and entry[1] > datetime.utcnow():
+                self._local.move_to_end(file_id); return entry[0]
+        return None
+
+    def _store_local(self, file_id, file_path, expires_at):
+        with self._lock:
+            self._local[file_id] = (file_path, expires_at); self._local.move_to_end(file_id)
+            while len(self._local) > self.max_size: self._local.popitem(last=False)
+
+    def resolve_path(self, file_id):
+        file_path = self._cached(file_id)
+        if file_path: self.hits += 1; return file_path
+        with self._lock:
+            event = self._inflight.get(file_id)
+            leader = event is None
+            if leader: event = self._inflight[file_id] = threading.Event()
+        if not leader:
+            self.coalesced += 1
+            event.wait(timeout=15)
+            file_path = self._cached(file_id)
+            if file_path: return file_path
+            raise RuntimeError(f"Could not resolve Telegram file {file_id}")
+        try:
+            now = datetime.utcnow()
+            doc = resolved_files_collection.find_one({"_id": file_id, "expires_at": {"$gt": now}})
+            if doc:
+                self.shared_hits += 1
+                file_path, expires_at = doc['file_path'], doc['expires_at']
+            else:
+                self.fetches += 1
+                file_path = get_telegram_file_path(file_id); expires_at = now + timedelta(seconds=self.ttl)
+                resolved_files_collection.replace_one({"_id": file_id}, {"_id": file_id, "file_path": file_path, "expires_at": expires_at}, upsert=True)
+            self._store_local(file_id, file_path, expires_at)
+            return file_path
+        finally:
+            with self._lock: self._inflight.pop(file_id, None)
+            event.set()
+
+    def invalidate(self, file_id):
+        """Forget a file path Telegram no longer serves (expired link) so the next resolve refetches it."""
+        with self._lock: self._local.pop(file_id, None)
+        try: resolved_files_collection.delete_one({"_id": file_id})
+        except Exception as e: app.logger.error(f"Failed to drop resolved path for {file_id}: {e}")
+
+    def stats(self): return {"hits": self.hits, "shared_hits": self.shared_hits, "fetches": self.fetches, "coalesced": self.coalesced, "size": len(self._local)}
+
+stream_resolver = StreamLinkResolver()
+
+# --- Stream Proxy ---
+STREAM_SEGMENT_SIZE = int(os.environ.get("STREAM_SEGMENT_SIZE", 2 * 1024 * 1024))  # max bytes per response; also the cache unit
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_MAX_UPSTREAM = int(os.environ.get("STREAM_MAX_UPSTREAM", 8))
+STREAM_SLOT_TIMEOUT = float(os.environ.get("STREAM_SLOT_TIMEOUT", 5))
+STREAM_READ_TIMEOUT = float(os.environ.get("STREAM_READ_TIMEOUT", 30))
+STREAM_CACHE_DIR = os.environ.get("STREAM_CACHE_DIR", "/tmp/stream_cache")
+STREAM_CACHE_MAX_BYTES = int(os.environ.get("STREAM_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # 0 disables the segment cache
+STREAM_HOT_HITS = int(os.environ.get("STREAM_HOT_HITS", 3))
+RANGE_RE = re.compile(r'^bytes=(\d+)-(\d*)$')
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+class SegmentCache:
+    """Segment-aligned byte ranges of hot files on local disk (one dir per file_id, LRU by mtime).
+    A file counts as hot after STREAM_HOT_HITS range requests in this process, or once prewarmed."""
+    def __init__(self, root=STREAM_CACHE_DIR, max_bytes=STREAM_CACHE_MAX_BYTES, hot_hits=STREAM_HOT_HITS):
+        self.root = root; self.max_bytes = max_bytes; self.hot_hits = hot_hits
+        self._requests = Counter(); self._hot = set(); self._lock = threading.Lock()
+        self.hits = 0; self.misses = 0; self.stored = 0; self.evicted = 0
+
+    def _dir(self, file_id): return os.path.join(self.root, hashlib.sha1(file_id.encode()).hexdigest())
+
+    def is_hot(self, file_id):
+        if self.max_bytes <= 0: return False
+        with self._lock:
+            self._requests[file_id] += 1
+            if len(self._requests) > 10000: self._requests = Counter(dict(self._requests.most_common(1000)))
+            return file_id in self._hot or self._requests[file_id] >= self.hot_hits
+
+    def mark_hot(self, file_id):
+        with self._lock: self._hot.add(file_id)
+
+    def get(self, file_id, index):
+        """(segment path, total size, content type) if the segment is on disk, else None."""
+        if self.max_bytes <= 0: return None
+        path = os.path.join(self._dir(file_id), f"{index}.seg")
+        try:
+            with open(os.path.join(self._dir(file_id), "meta.json")) as f: meta = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1; return None
+        self.hits += 1
+        return path, meta['size'], meta['content_type']
+
+    def put(self, file_id, index, data, total, content_type):
+        directory = self._dir(file_id)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for name, payload in (("meta.json", json.dumps({"size": total, "content_type": content_type}).encode()), (f"{index}.seg", data)):
+                tmp = os.path.join(directory, f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                with open(tmp, "wb") as f: f.write(payload)
+                os.replace(tmp, os.path.join(directory, name))  # readers never see a half-written segment
+            self.stored += 1
+            self._evict()
+        except OSError as e: app.logger.error(f"Segment cache write failed for {file_id}: {e}")
+
+    def _evict(self):
+        segments = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".seg"): continue
+                path = os.path.join(directory, name)
+                try: st = os.stat(path)
+                except OSError: continue
+                segments.append((st.st_mtime, st.st_size, path))
+        used = sum(size for _, size, _ in segments)
+        for _, size, path in sorted(segments):
+            if used <= self.max_bytes: break
+            try: os.remove(path); used -= size; self.evicted += 1
+            except OSError: pass
+
+    def stats(self): return {"hits": self.hits, "misses": self.misses, "stored": self.stored, "evicted": self.evicted, "hot": len(self._hot)}
+
+
+class StreamProxy:
+    """Same-origin, Range-aware proxy for Telegram-hosted video, so the bot-token URL never reaches the browser.
+    Every ranged response covers at most one STREAM_SEGMENT_SIZE-aligned segment (players simply ask for the
+    next range); a request without Range gets the whole file as a streamed 200. Bodies are relayed chunk by
+    chunk, and upstream fetches share a bounded pool of slots."""
+    def __init__(self, max_upstream=STREAM_MAX_UPSTREAM, segment_size=STREAM_SEGMENT_SIZE):
+        self.segment_size = segment_size
+        self.slots = threading.BoundedSemaphore(max_upstream)
+        self.cache = SegmentCache()
+        self.requests = 0; self.upstream = 0; self.rejected = 0; self.bytes_out = 0
+        self.ttfb = deque(maxlen=500)
+
+    @staticmethod
+    def _content_type(res, file_path):
+        content_type = res.headers.get('Content-Type', '')
+        if not content_type or content_type == 'application/octet-stream':
+            content_type = mimetypes.guess_type(file_path)[0] or 'video/mp4'
+        return content_type
+
+    def _open_upstream(self, file_id, range_header):
+        """GET the file with stream=True; an expired file path (403/404) is re-resolved once."""
+        for attempt in range(2):
+            file_path = stream_resolver.resolve_path(file_id)
+            url = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}"
+            res = http_client.get(url, headers={"Range": range_header} if range_header else {}, stream=True, timeout=STREAM_READ_TIMEOUT, retries=1)
+            if res.status_code not in (403, 404) or attempt: return res, file_path
+            res.close(); stream_resolver.invalidate(file_id)
+
+    def _relay(self, res, skip, length, started, on_done, cache_fill=None):
+        """Yield `length` bytes (None: everything) of the upstream body after dropping `skip` bytes."""
+        buffered = [] if cache_fill else None
+        first = True
+        try:
+            for chunk in res.iter_content(STREAM_CHUNK_SIZE):
+                if buffered is not None: buffered.append(chunk)
+                if skip:
+                    dropped = min(skip, len(chunk)); chunk = chunk[dropped:]; skip -= dropped
+                if length is not None: chunk = chunk[:length]; length -= len(chunk)
+                if chunk:
+                    if first: self.ttfb.append(time.perf_counter() - started); first = False
+                    self.bytes_out += len(chunk); yield chunk
+                if length == 0 and buffered is None: break
+        finally: on_done()  # free the upstream slot as soon as the body is done, not when the client hangs up
+        if buffered is not None: cache_fill(b"".join(buffered))
+
+    def _from_disk(self, path, offset, length):
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while length > 0:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+                if not chunk: break
+                length -= len(chunk); self.bytes_out += len(chunk); yield chunk
+
+    def _response(self, body, status, headers, on_close=None):
+        response = Response(body, status=status, direct_passthrough=True)
+        for name, value in headers.items():
+            if value is not None: response.headers[name] = str(value)
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Cache-Control'] = 'private, max-age=3600'
+        if on_close: response.call_on_close(on_close)
+        return response
+
+    def serve(self, file_id, range_header):
+        self.requests += 1
+        started = time.perf_counter()
+        match = RANGE_RE.match(range_header.replace(' ', '')) if range_header else None
+        if match and match.group(2) and int(match.group(2)) < int(match.group(1)): match = None
+        if match:
+            start = int(match.group(1))
+            index = start // self.segment_size
+            seg_start = index * self.segment_size; seg_end = seg_start + self.segment_size - 1
+            end = min(int(match.group(2)), seg_end) if match.group(2) else seg_end
+            hot = self.cache.is_hot(file_id)
+            cached = self.cache.get(file_id, index) if hot else None
+            if cached:
+                path, total, content_type = cached
+                if start >= total: return self._response(b"", 416, {"Content-Range": f"bytes */{total}"})
+                end = min(end, total - 1)
+                self.ttfb.append(time.perf_counter() - started)
+                return self._response(self._from_disk(path, start - seg_start, end - start + 1), 206, {
+                    "Content-Type": content_type, "Content-Length": end - start + 1, "Content-Range": f"bytes {start}-{end}/{total}"})
+            # Fetch the whole segment when it will be cached and the client wants through its end anyway.
+            fill = hot and end == seg_end
+            upstream_range = f"bytes={seg_start if fill else start}-{end}"
+        else:
+            upstream_range = None  # no Range (full 200 download) or suffix/multi range: relay the upstream answer as-is
+
+        if not self.slots.acquire(timeout=STREAM_SLOT_TIMEOUT):
+            self.rejected += 1
+            return Response("Too many streams right now, please retry.", 503, {"Retry-After": "2"})
+        released = []
+        def release():
+            if not released: released.append(True); self.slots.release()
+        try:
+            res, file_path = self._open_upstream(file_id, upstream_range or range_header)
+        except Exception as e:
+            release(); app.logger.error(f"Stream proxy failed for {file_id}: {e}")
+            return "Stream temporarily unavailable. Please try again in a moment.", 503
+        self.upstream += 1
+        def close():
+            res.close(); release()
+        content_type = self._content_type(res, file_path)
+        if res.status_code >= 400:
+            close()
+            if res.status_code == 416: return self._response(b"", 416, {"Content-Range": res.headers.get('Content-Range')})
+            app.logger.error(f"Upstream returned {res.status_code} for {file_id}")
+            return "Stream temporarily unavailable. Please try again in a moment.", 503
+        content_range = CONTENT_RANGE_RE.match(res.headers.get('Content-Range', ''))
+        if not match or res.status_code != 206 or not content_range:
+            return self._response(self._relay(res, 0, None, started, close), res.status_code, {
+                "Content-Type": content_type, "Content-Length": res.headers.get('Content-Length'), "Content-Range": res.headers.get('Content-Range')}, close)
+        got_start, got_end, total = (int(g) for g in content_range.groups())
+        if start > got_end:
+            close(); return self._response(b"", 416, {"Content-Range": f"bytes */{total}"})
+        end = min(end, got_end)
+        cache_fill = None
+        if fill and got_start == seg_start and got_end in (seg_end, total - 1):
+            cache_fill = lambda data: self.cache.put(file_id, index, data, total, content_type) if len(data) == got_end - got_start + 1 else None
+        body = self._relay(res, start - got_start, end - start + 1, started, close, cache_fill)
+        return self._response(body, 206, {"Content-Type": content_type, "Content-Length": end - start + 1, "Content-Range": f"bytes {start}-{end}/{total}"}, close)
+
+    def stats(self):
+        window = sorted(self.ttfb)
+        return {"requests": self.requests, "upstream": self.upstream, "rejected": self.rejected, "bytes_out": self.bytes_out,
+                "ttfb_p50_ms": percentile_ms(window, 0.5), "ttfb_p95_ms": percentile_ms(window, 0.95), "segment_cache": self.cache.stats()}
+
+stream_proxy = StreamProxy()
 
 def get_tmdb_details(tmdb_id, media_type):
+    """Cache-first TMDB lookup keyed by (media_type, tmdb_id).
+    Fresh hits return directly, stale hits return immediately and queue a background refresh,
+    and 404s are negatively cached so dead IDs don't keep costing round trips."""
     if not TMDB_API_KEY: return None
-    search_type = "tv" if media_type == "series" else "movie"
+    key = _tmdb_cache_key(tmdb_id, media_type)
+    doc = tmdb_cache_collection.find_one({"_id": key})
+    if doc:
+        age = (datetime.utcnow() - doc['fetched_at']).total_seconds()
+        if doc['status'] == 'not_found' and age < TMDB_NEGATIVE_TTL: return None
+        if doc['status'] == 'ok' and age < TMDB_FRESH_TTL: return doc['data']
+        if doc['status'] == 'ok' and age < TMDB_STALE_TTL:
+            try:
+                job_queue.enqueue("tmdb_refresh", {"tmdb_id": tmdb_id, "media_type": media_type}, job_id=f"tmdb_refresh:{key}:{int(doc['fetched_at'].timestamp())}")
+            except Exception as e: app.logger.error(f"Failed to queue TMDB refresh for {key}: {e}")
+            return doc['data']
     try:
-        detail_url = f"https://api.themoviedb.org/3/{search_type}/{tmdb_id}?api_key={TMDB_API_KEY}"
-        res = requests.get(detail_url, timeout=10)
+        details = fetch_tmdb_details(tmdb_id, media_type)
+    except requests.RequestException:
+        return doc['data'] if doc and doc['status'] == 'ok' else None
+    try: store_tmdb_details(tmdb_id, media_type, details)
+    except Exception as e: app.logger.error(f"Failed to cache TMDB details for {key}: {e}")
+    return details
+
+# --- Caption Parsing ---
+CAPTION_EPISODE_RE = re.compile(r'\bS(\d{1,2})\s*[-_ ]?\s*E(?:P)?\s*(\d{1,3})\b', re.I)
+CAPTION_YEAR_RE = re.compile(r'(?<!\d)((?:19|20)\d{2})(?!\d)')
+CAPTION_QUALITY_RE = re.compile(r'\b(2160p|1080p|720p|480p|360p|4K|HDR|WEB-?DL|WEB-?Rip|Blu-?Ray|BRRip|HDRip|DVDRip|HDTS|HDCAM|CAMRip|x264|x265|HEVC)\b', re.I)
+BENGALI_DIGITS = str.maketrans("০১২৩৪৫৬৭৮৯", "0123456789")
+LANGUAGE_NAMES = {"bn": "Bangla", "hi": "Hindi", "en": "English", "ta": "Tamil", "te": "Telugu", "ml": "Malayalam", "ko": "Korean", "ja": "Japanese"}
+
+def parse_caption(caption):
+    """Pull title, year, SxxEyy and quality tags out of an upload caption / release-style file name."""
+    first_line = (caption or '').split('\n')[0].strip()
+    name = re.sub(r'[._]+', ' ', first_line)
+    ascii_name = name.translate(BENGALI_DIGITS)  # same length, so match offsets still apply to `name`
+    episode = CAPTION_EPISODE_RE.search(ascii_name)
+    year = CAPTION_YEAR_RE.search(ascii_name)
+    qualities = CAPTION_QUALITY_RE.findall(ascii_name)
+    cut_points = [m.start() for m in (episode, year, CAPTION_QUALITY_RE.search(ascii_name)) if m]
+    title = name[:min(cut_points)] if cut_points and min(cut_points) > 0 else name
+    title = re.sub(r'[\s\-\[\(|:]+$', '', title).strip() or first_line
+    return {
+        "title": title,
+        "year": int(year.group(1)) if year else None,
+        "season": int(episode.group(1)) if episode else None,
+        "episode_number": int(episode.group(2)) if episode else None,
+        "quality": list(dict.fromkeys(qualities)),
+    }
+
+def search_tmdb(title, year, media_type):
+    """First TMDB search hit for a parsed title; retries without the year if that finds nothing."""
+    search_type = "tv" if media_type == "series" else "movie"
+    year_param = "first_air_date_year" if search_type == "tv" else "year"
+    for with_year in ([True, False] if year else [False]):
+        params = {"api_key": TMDB_API_KEY, "query": title}
+        if with_year: params[year_param] = year
+        tmdb_rate_limiter.acquire()
+        res = http_client.get(f"https://api.themoviedb.org/3/search/{search_type}", params=params, timeout=10)
         res.raise_for_status()
-        data = res.json()
-        details = { "tmdb_id": tmdb_id, "title": data.get("title") or data.get("name"), "poster": f"https://image.tmdb.org/t/p/w500{data.get('poster_path')}" if data.get('poster_path') else None, "backdrop": f"https://image.tmdb.org/t/p/w1280{data.get('backdrop_path')}" if data.get('backdrop_path') else None, "overview": data.get("overview"), "release_date": data.get("release_date") or data.get("first_air_date"), "genres": [g['name'] for g in data.get("genres", [])], "vote_average": data.get("vote_average"), "type": "series" if search_type == "tv" else "movie", "original_language": data.get("original_language") }
-        return details
-    except requests.RequestException as e: return None
+        results = res.json().get('results') or []
+        if results: return results[0]['id']
+    return None
 
 def time_ago(obj_id):
     if not isinstance(obj_id, ObjectId): return ""
@@ -141,15 +959,338 @@ def time_ago(obj_id):
     else: days = int(seconds / 86400); return f"{days} day ago"
 
 
+# --- Document Shapes (projections) ---
+# card: everything render_movie_card needs (+ updated_at for keyset cursors); hero: the slider adds backdrop;
+# detail: the full document minus ingestion bookkeeping. Series can carry hundreds of episode links,
+# so list/shelf queries must never fetch more than the card.
+CARD_FIELDS = {"title": 1, "poster": 1, "type": 1, "language": 1, "updated_at": 1}
+PROJECTIONS = {
+    "card": CARD_FIELDS,
+    "hero": {**CARD_FIELDS, "backdrop": 1},
+    "detail": {"pending_notify": 0, "notify_scheduled": 0, "enrichment": 0, "series_key": 0},
+    "export": {"pending_notify": 0, "notify_scheduled": 0},
+}
+
+# --- Homepage Data Engine ---
+HOME_SLIDER_LIMIT = 8
+HOME_SHELF_LIMIT = 10
+
+def _shelf_pipeline(shelf_key, match, sort_field, limit, shape="card"):
+    return [{"$match": match}, {"$sort": {sort_field: -1}}, {"$limit": limit}, {"$project": {**PROJECTIONS[shape], "_shelf": {"$literal": shelf_key}}}]
+
+def home_pipeline(category_names):
+    """Each shelf is its own index-friendly $match/$sort/$limit sub-pipeline chained with $unionWith."""
+    shelves = [("latest", {}, 'created_at', HOME_SHELF_LIMIT)]
+    shelves += [(f"cat:{i}", {"categories": cat}, 'updated_at', HOME_SHELF_LIMIT) for i, cat in enumerate(category_names)]
+    pipeline = _shelf_pipeline("slider", {}, 'updated_at', HOME_SLIDER_LIMIT, shape="hero")
+    for shelf_key, match, sort_field, limit in shelves:
+        pipeline.append({"$unionWith": {"coll": movies.name, "pipeline": _shelf_pipeline(shelf_key, match, sort_field, limit)}})
+    return pipeline
+
+def get_home_content(category_names):
+    """Slider, latest and every category shelf in ONE aggregation round trip."""
+    grouped = {}
+    for doc in movies.aggregate(home_pipeline(category_names)):
+        grouped.setdefault(doc.pop('_shelf'), []).append(doc)
+    categorized_content = {cat: grouped[f"cat:{i}"] for i, cat in enumerate(category_names) if grouped.get(f"cat:{i}")}
+    return grouped.get("slider", []), grouped.get("latest", []), categorized_content
+
+
+# --- Materialized Home Snapshot ---
+HOME_SNAPSHOT_ID = "home"
+HOME_SNAPSHOT_MAX_AGE = int(os.environ.get("HOME_SNAPSHOT_MAX_AGE", 3600))
+HOME_REBUILD_DELAY = int(os.environ.get("HOME_REBUILD_DELAY", 10))
+HOME_REBUILD_LEASE_ID = "home_rebuild_lease"
+HOME_REBUILD_LEASE_SECONDS = 30
+HOME_REBUILD_WAIT = float(os.environ.get("HOME_REBUILD_WAIT", 2))  # seconds a request without any snapshot waits for another instance's rebuild
+
+def rebuild_home_snapshot():
+    """Materialize every shelf (empty ones too, so inserts can be pushed into them) into one small document."""
+    category_names = get_category_names()
+    slider, latest, categorized = get_home_content(category_names)
+    snapshot = {"_id": HOME_SNAPSHOT_ID, "slider": slider, "latest": latest, "categories": category_names, "ranked": get_ranked_shelves(),
+                "shelves": [{"name": cat, "items": categorized.get(cat, [])} for cat in category_names], "built_at": datetime.utcnow()}
+    home_snapshot_collection.replace_one({"_id": HOME_SNAPSHOT_ID}, snapshot, upsert=True)
+    return snapshot
+
+def _claim_home_rebuild():
+    """Lease so only one request rebuilds a missing snapshot; the upsert collides on _id while the lease is held."""
+    now = datetime.utcnow()
+    try:
+        home_snapshot_collection.update_one({"_id": HOME_REBUILD_LEASE_ID, "lease_until": {"$lt": now}},
+                                            {"$set": {"lease_until": now + timedelta(seconds=HOME_REBUILD_LEASE_SECONDS)}}, upsert=True)
+        return True
+    except DuplicateKeyError: return False
+
+def get_home_snapshot():
+    """One small read for the whole homepage. A snapshot older than HOME_SNAPSHOT_MAX_AGE (a safety net for edits
+    made outside the app) is served as-is while a coalesced rebuild job refreshes it. Only a missing snapshot
+    is built inline, by the single request holding the rebuild lease; concurrent ones wait briefly for it and then
+    read the shelves live, so an empty homepage never reaches the page cache or the CDN."""
+    snapshot = home_snapshot_collection.find_one({"_id": HOME_SNAPSHOT_ID})
+    if snapshot and (datetime.utcnow() - snapshot['built_at']).total_seconds() > HOME_SNAPSHOT_MAX_AGE:
+        schedule_home_rebuild()
+    elif not snapshot:
+        if _claim_home_rebuild():
+            try: snapshot = rebuild_home_snapshot()
+            except Exception:
+                home_snapshot_collection.delete_one({"_id": HOME_REBUILD_LEASE_ID}); raise  # don't make others wait out the lease
+            catalogue_generation.bump()  # drop pages cached while the snapshot was missing
+        else:
+            deadline = time.monotonic() + HOME_REBUILD_WAIT
+            while not snapshot and time.monotonic() < deadline:
+                time.sleep(0.25); snapshot = home_snapshot_collection.find_one({"_id": HOME_SNAPSHOT_ID})
+            if not snapshot:
+                slider, latest, categorized = get_home_content(get_category_names())
+                return slider, latest, categorized, [(shelf['name'], shelf['items']) for shelf in get_ranked_shelves() if shelf.get('items')]
+    categorized = {shelf['name']: shelf['items'] for shelf in snapshot.get('shelves', []) if shelf.get('items')}
+    ranked = [(shelf['name'], shelf['items']) for shelf in snapshot.get('ranked', []) if shelf.get('items')]
+    return snapshot.get('slider', []), snapshot.get('latest', []), categorized, ranked
+
+def _shape(doc, shape): return {"_id": doc['_id'], **{field: doc.get(field) for field in PROJECTIONS[shape] if field in doc}}
+
+def home_snapshot_on_insert(doc):
+    """Incremental update for a brand-new title: push it onto the front of the slider, latest and its category shelves."""
+    card = _shape(doc, "card")
+    try:
+        home_snapshot_collection.update_one(
+            {"_id": HOME_SNAPSHOT_ID},
+            {"$push": {"slider": {"$each": [_shape(doc, "hero")], "$position": 0, "$slice": HOME_SLIDER_LIMIT},
+                       "latest": {"$each": [card], "$position": 0, "$slice": HOME_SHELF_LIMIT},
+                       "shelves.$[shelf].items": {"$each": [card], "$position": 0, "$slice": HOME_SHELF_LIMIT}}},
+            array_filters=[{"shelf.name": {"$in": doc.get('categories') or []}}])
+    except Exception as e: app.logger.error(f"Home snapshot incremental insert failed: {e}")
+
+def home_snapshot_on_delete(movie_id):
+    """Drop a deleted title everywhere at once; the queued rebuild refills the shelves."""
+    try:
+        home_snapshot_collection.update_one({"_id": HOME_SNAPSHOT_ID}, {"$pull": {"slider": {"_id": movie_id}, "latest": {"_id": movie_id}, "shelves.$[].items": {"_id": movie_id}, "ranked.$[].items": {"_id": movie_id}}})
+        rankings_collection.update_many({}, {"$pull": {"items": {"_id": movie_id}}})  # or the queued rebuild would copy it back
+    except Exception as e: app.logger.error(f"Home snapshot incremental delete failed: {e}")
+
+def check_home_snapshot():
+    """Compare the stored snapshot with a fresh computation; returns the names of shelves that differ."""
+    snapshot = home_snapshot_collection.find_one({"_id": HOME_SNAPSHOT_ID})
+    if not snapshot: return ["<missing>"]
+    slider, latest, categorized = get_home_content(get_category_names())
+    ids = lambda items: [item['_id'] for item in items]
+    stored = {shelf['name']: shelf['items'] for shelf in snapshot.get('shelves', []) if shelf.get('items')}
+    mismatches = [name for name, fresh, kept in (("slider", slider, snapshot.get('slider', [])), ("latest", latest, snapshot.get('latest', []))) if ids(fresh) != ids(kept)]
+    mismatches += [name for name in set(categorized) | set(stored) if ids(categorized.get(name, [])) != ids(stored.get(name, []))]
+    return mismatches
+
+def schedule_home_rebuild():
+    try: enqueue_coalesced("rebuild_home", delay=HOME_REBUILD_DELAY, slot_seconds=HOME_REBUILD_DELAY)
+    except Exception as e: app.logger.error(f"Failed to queue home snapshot rebuild: {e}")
+
+
+# --- Buffered View Counter ---
+VIEW_FLUSH_SIZE = int(os.environ.get("VIEW_FLUSH_SIZE", 50))
+VIEW_FLUSH_INTERVAL = int(os.environ.get("VIEW_FLUSH_INTERVAL", 10))
+
+class ViewCounter:
+    """Accumulates detail-page views in memory and writes them as one unordered bulk_write of $inc ops.
+    A flush is attempted after each response is sent (call_on_close), so a frozen serverless
+    instance loses at most the views since its last request."""
+    def __init__(self, flush_size=VIEW_FLUSH_SIZE, flush_interval=VIEW_FLUSH_INTERVAL):
+        self.flush_size = flush_size; self.flush_interval = flush_interval
+        self._pending = Counter(); self._lock = threading.Lock(); self._last_flush = time.monotonic()
+        self.recorded = 0; self.flushes = 0; self.write_ops = 0
+
+    def record(self, movie_id):
+        with self._lock: self._pending[movie_id] += 1; self.recorded += 1
+
+    def should_flush(self):
+        with self._lock:
+            if not self._pending: return False
+            return sum(self._pending.values()) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, Counter()
+            self._last_flush = time.monotonic()
+        if not batch: return 0
+        ops = [UpdateOne({"_id": movie_id}, {"$inc": {"view_count": n}}) for movie_id, n in batch.items()]
+        try:
+            movies.bulk_write(ops, ordered=False)
+            self.flushes += 1; self.write_ops += len(ops)
+        except Exception as e:
+            app.logger.error(f"View count flush failed, will retry: {e}")
+            with self._lock: self._pending.update(batch)
+            return 0
+        record_view_buckets(batch)
+        return len(ops)
+
+    def maybe_flush(self):
+        if self.should_flush(): self.flush()
+
+    def stats(self):
+        with self._lock: pending = sum(self._pending.values())
+        return {"recorded": self.recorded, "pending": pending, "flushes": self.flushes, "write_ops": self.write_ops}
+
+view_counter = ViewCounter()
+atexit.register(view_counter.flush)
+
+def record_view_buckets(batch):
+    """Hourly time buckets ({movie_id, hour, views}) feeding the trending/popularity rankings.
+    Best effort: the lifetime view_count above is already written, so a failure here is not retried."""
+    hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    ops = [UpdateOne({"_id": f"{movie_id}:{hour:%Y%m%d%H}"}, {"$inc": {"views": n}, "$setOnInsert": {"movie_id": movie_id, "hour": hour}}, upsert=True)
+           for movie_id, n in batch.items()]
+    try: view_buckets_collection.bulk_write(ops, ordered=False)
+    except Exception as e: app.logger.error(f"View bucket write failed: {e}")
+
+
+# --- Popularity / Trending ---
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", 24))
+TRENDING_INTERVAL = int(os.environ.get("TRENDING_INTERVAL", 900))
+RANKED_SHELF_LIMIT = 10
+RANKED_SHELVES = (("trending_now", "Trending Now"), ("most_watched_week", "Most Watched This Week"))
+
+def compute_rankings():
+    """Batch job: score = sum(views * 0.5 ** (age_hours / half_life)) over the last week of hourly buckets,
+    plus a plain 7-day total. Both ranked lists are stored as card documents in `rankings`."""
+    now = datetime.utcnow()
+    decay = math.log(2) / TRENDING_HALF_LIFE_HOURS
+    age_hours = {"$divide": [{"$subtract": [now, "$hour"]}, 3600 * 1000]}
+    scored = list(view_buckets_collection.aggregate([
+        {"$match": {"hour": {"$gte": now - timedelta(days=7)}}},
+        {"$group": {"_id": "$movie_id", "week": {"$sum": "$views"},
+                    "score": {"$sum": {"$multiply": ["$views", {"$exp": {"$multiply": [-decay, age_hours]}}]}}}},
+    ], allowDiskUse=True))
+    ranked_ids = {
+        "trending_now": [doc['_id'] for doc in sorted(scored, key=lambda d: d['score'], reverse=True)[:RANKED_SHELF_LIMIT]],
+        "most_watched_week": [doc['_id'] for doc in sorted(scored, key=lambda d: d['week'], reverse=True)[:RANKED_SHELF_LIMIT]],
+    }
+    all_ids = {movie_id for ids in ranked_ids.values() for movie_id in ids}
+    cards = {doc['_id']: doc for doc in movies.find({"_id": {"$in": list(all_ids)}}, PROJECTIONS["card"])}
+    for ranking_id, ids in ranked_ids.items():
+        items = [cards[movie_id] for movie_id in ids if movie_id in cards]
+        rankings_collection.replace_one({"_id": ranking_id}, {"_id": ranking_id, "items": items, "built_at": now}, upsert=True)
+    return {ranking_id: len(ids) for ranking_id, ids in ranked_ids.items()}
+
+def get_ranked_shelves():
+    """[(title, items)] for the precomputed popularity shelves."""
+    docs = {doc['_id']: doc for doc in rankings_collection.find({"_id": {"$in": [rid for rid, _ in RANKED_SHELVES]}})}
+    return [{"name": title, "items": docs.get(rid, {}).get('items', [])} for rid, title in RANKED_SHELVES]
+
+@app.after_request
+def schedule_view_flush(response):
+    response.call_on_close(view_counter.maybe_flush)
+    return response
+
+
+# --- Search Engine ---
+SEARCH_MAX_QUERY_LEN = 100
+SEARCH_COUNT_CAP = 1000
+SEARCH_FALLBACK_TIMEOUT_MS = 2000
+
+def search_text_query(query):
+    """(filter, projection, sort) for ranked text search: best textScore first, newest among ties."""
+    score = {"$meta": "textScore"}
+    return {"$text": {"$search": query}}, {**PROJECTIONS["card"], "score": score}, [("score", score), ("updated_at", -1)]
+
+def search_fallback_query(query):
+    """(filter, projection, sort) for the anchored title prefix fallback."""
+    return {"title": {"$regex": f"^{re.escape(query)}", "$options": "i"}}, PROJECTIONS["card"], [("title", 1)]
+
+def search_content(query, page):
+    """Ranked full-text search over title/overview/genres/language.
+    default_language "none" tokenizes without stemming, so Bengali and Latin titles match alike.
+    Falls back to an escaped, time-bounded title prefix match in title order (walks title_1) only when the text index finds nothing.
+    A capped total is passed on as unknown, so the page shows "Page X of many" instead of stopping at the cap."""
+    query = query[:SEARCH_MAX_QUERY_LEN]
+    skip = (page - 1) * ITEMS_PER_PAGE
+    text_filter, projection, sort = search_text_query(query)
+    try: total = count_provider.count(text_filter, limit=SEARCH_COUNT_CAP)
+    except OperationFailure as e:
+        if e.code != 27: raise  # 27 IndexNotFound: migrations haven't run on this database yet
+        schedule_migrations(); total = 0
+    if total != 0:
+        cursor = movies.find(text_filter, projection).sort(sort)
+    else:
+        fallback_filter, projection, sort = search_fallback_query(query)
+        total = count_provider.count(fallback_filter, limit=SEARCH_COUNT_CAP)
+        cursor = movies.find(fallback_filter, projection).sort(sort).max_time_ms(SEARCH_FALLBACK_TIMEOUT_MS)
+    try: results = list(cursor.skip(skip).limit(ITEMS_PER_PAGE))
+    except ExecutionTimeout:
+        app.logger.warning(f"Search fallback timed out for {query!r}"); results = []
+    if total == SEARCH_COUNT_CAP: total = None
+    return results, Pagination(page, ITEMS_PER_PAGE, total, has_more=len(results) == ITEMS_PER_PAGE)
+
+
+# --- Count Provider (cached totals for Pagination) ---
+COUNT_CACHE_TTL = int(os.environ.get("COUNT_CACHE_TTL", 120))
+COUNT_TIMEOUT_MS = int(os.environ.get("COUNT_TIMEOUT_MS", 1500))
+
+class CountProvider:
+    """Per-filter totals cached with a TTL and adjusted in place when this instance inserts/deletes.
+    Unfiltered views use estimated_document_count (collection metadata, no scan).
+    A count that exceeds COUNT_TIMEOUT_MS is cached as None and shown as "Page X of many"."""
+    def __init__(self, ttl=COUNT_CACHE_TTL, max_size=256):
+        self.ttl = ttl; self.max_size = max_size
+        self._entries = OrderedDict(); self._lock = threading.Lock()
+        self.hits = 0; self.misses = 0
+
+    @staticmethod
+    def _key(query_filter, limit): return json.dumps([query_filter, limit], sort_keys=True, default=str)
+
+    @staticmethod
+    def _matches(query_filter, doc):
+        """True/False for plain equality filters (incl. array membership); None if we can't tell."""
+        for field, expected in query_filter.items():
+            if field.startswith('$') or isinstance(expected, dict): return None
+            value = doc.get(field)
+            if not (value == expected or (isinstance(value, list) and expected in value)): return False
+        return True
+
+    def count(self, query_filter, limit=None):
+        key = self._key(query_filter, limit); now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now < entry['expires']:
+                self.hits += 1; return entry['total']
+        self.misses += 1
+        try:
+            if not query_filter and limit is None: total = movies.estimated_document_count()
+            else:
+                kwargs = {"maxTimeMS": COUNT_TIMEOUT_MS}
+                if limit: kwargs['limit'] = limit
+                total = movies.count_documents(query_filter, **kwargs)
+        except ExecutionTimeout:
+            total = None
+        with self._lock:
+            self._entries[key] = {"total": total, "expires": now + self.ttl, "filter": query_filter, "limit": limit}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size: self._entries.popitem(last=False)
+        return total
+
+    def _apply(self, doc, delta):
+        with self._lock:
+            for key in list(self._entries):
+                entry = self._entries[key]
+                matched = self._matches(entry['filter'], doc)
+                if matched is None or entry['limit']: del self._entries[key]
+                elif matched and entry['total'] is not None: entry['total'] = max(entry['total'] + delta, 0)
+
+    def record_insert(self, doc): self._apply(doc, 1)
+    def record_delete(self, doc): self._apply(doc, -1)
+
+    def stats(self): return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+count_provider = CountProvider()
+
+
 class Pagination:
-    def __init__(self, page, per_page, total_count):
+    def __init__(self, page, per_page, total_count, next_cursor=None, prev_cursor=None, has_more=False):
         self.page = page; self.per_page = per_page; self.total_count = total_count
+        self.next_cursor = next_cursor; self.prev_cursor = prev_cursor; self.has_more = has_more
     @property
-    def total_pages(self): return math.ceil(self.total_count / self.per_page)
+    def total_pages(self): return math.ceil(self.total_count / self.per_page) if self.total_count is not None else None
     @property
     def has_prev(self): return self.page > 1
     @property
-    def has_next(self): return self.page < self.total_pages
+    def has_next(self): return self.has_more if self.total_pages is None else self.page < self.total_pages
     @property
     def prev_num(self): return self.page - 1
     @property
@@ -159,18 +1300,85 @@ class Pagination:
 app.jinja_env.filters['time_ago'] = time_ago
 app.jinja_env.filters['striptags'] = lambda x: x
 app.jinja_env.filters['truncate'] = lambda s, length: s[:length] + '...' if len(s) > length else s
+app.jinja_env.add_extension('jinja2.ext.loopcontrols')  # detail_html uses {% break %}
+
+
+# --- Versioned Site Config Cache ---
+SITE_CACHE_TTL = int(os.environ.get("SITE_CACHE_TTL", 30))
+SITE_CACHE_MAX_AGE = int(os.environ.get("SITE_CACHE_MAX_AGE", 600))
+CACHE_VERSION_ID = "cache_version"
+
+class VersionedCache:
+    """Bounded in-process cache for site-wide config.
+    Every `ttl` seconds a warm instance reads only a tiny generation counter from
+    `settings` ({_id: "cache_version", <namespace>: n}); entries are dropped when it moves.
+    `max_age` is a safety net for edits made directly in the database."""
+    def __init__(self, namespace, ttl=SITE_CACHE_TTL, max_age=SITE_CACHE_MAX_AGE, max_size=64):
+        self.namespace = namespace; self.ttl = ttl; self.max_age = max_age; self.max_size = max_size
+        self._entries = OrderedDict(); self._lock = threading.Lock()
+        self._version = None; self._validated_until = 0.0
+        self.hits = 0; self.misses = 0; self.version_checks = 0
+
+    def _read_version(self):
+        self.version_checks += 1
+        doc = settings.find_one({"_id": CACHE_VERSION_ID}, {self.namespace: 1}) or {}
+        return doc.get(self.namespace, 0)
+
+    def _revalidate(self, now):
+        if now < self._validated_until: return
+        version = self._read_version()
+        with self._lock:
+            if version != self._version: self._entries.clear(); self._version = version
+            self._validated_until = now + self.ttl
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        try: self._revalidate(now)
+        except Exception as e: app.logger.error(f"Cache version check failed ({self.namespace}): {e}")
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] < self.max_age:
+                self._entries.move_to_end(key); self.hits += 1
+                return entry[0]
+        self.misses += 1
+        value = loader()
+        with self._lock:
+            self._entries[key] = (value, now); self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size: self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        """Write-through invalidation: bump the shared generation so every warm instance reloads."""
+        with self._lock: self._entries.clear(); self._validated_until = 0.0
+        settings.update_one({"_id": CACHE_VERSION_ID}, {"$inc": {self.namespace: 1}}, upsert=True)
+
+    def stats(self):
+        return {"namespace": self.namespace, "hits": self.hits, "misses": self.misses, "version_checks": self.version_checks, "size": len(self._entries)}
+
+site_cache = VersionedCache("site_config")
+
+def get_ad_settings():
+    try: return site_cache.get("ad_config", lambda: settings.find_one({"_id": "ad_config"}) or {})
+    except Exception as e:
+        app.logger.error(f"Could not load ad settings: {e}"); return {}
+
+def get_category_names():
+    try: return site_cache.get("categories", lambda: [cat['name'] for cat in categories_collection.find().sort("name", 1)])
+    except Exception as e:
+        app.logger.error(f"Could not load categories: {e}"); return []
+
+def invalidate_site_config():
+    """Call after any write to ad_config or the categories collection."""
+    try: site_cache.invalidate()
+    except Exception as e: app.logger.error(f"Failed to invalidate site config cache: {e}")
+    bump_catalogue_generation()  # ads/categories are baked into cached pages
 
 
 @app.context_processor
 def inject_globals():
-    # --- Protected injection to prevent 'undefined' errors ---
-    ad_settings = {}
-    if settings is not None:
-        ad_settings = settings.find_one({"_id": "ad_config"}) or {}
-    
-    all_categories = []
-    if categories_collection is not None:
-        all_categories = [cat['name'] for cat in categories_collection.find().sort("name", 1)]
+    # --- Served from the versioned cache; DB is only touched on a miss ---
+    ad_settings = get_ad_settings()
+    all_categories = get_category_names()
     
     return dict(
         website_name=WEBSITE_NAME, 
@@ -283,16 +1491,20 @@ index_html = """
     <div class="full-page-grid-container container">
         <h2 class="full-page-grid-title">{{ query }}</h2>
         <div class="full-page-grid">{% for m in movies %}{{ render_movie_card(m) }}{% endfor %}</div>
-        {% if pagination and pagination.total_pages > 1 %}
+        {% if pagination and (pagination.total_pages is none or pagination.total_pages > 1) %}
         <div class="pagination">
             {% set url_args = {'page': pagination.prev_num} %}
+            {% if pagination.prev_cursor %}{% set _ = url_args.update({'cursor': pagination.prev_cursor}) %}{% endif %}
             {% if 'category' in request.endpoint %}{% set _ = url_args.update({'name': query}) %}{% endif %}
+            {% if request.endpoint == 'home' %}{% set _ = url_args.update({'q': request.args.get('q', '')}) %}{% endif %}
             
             {% if pagination.has_prev %}<a href="{{ url_for(request.endpoint, **url_args) }}">&laquo; Prev</a>{% endif %}
-            <span class="current">Page {{ pagination.page }} of {{ pagination.total_pages }}</span>
+            <span class="current">Page {{ pagination.page }} of {{ pagination.total_pages if pagination.total_pages is not none else 'many' }}</span>
             
             {% set url_args = {'page': pagination.next_num} %}
+            {% if pagination.next_cursor %}{% set _ = url_args.update({'cursor': pagination.next_cursor}) %}{% endif %}
             {% if 'category' in request.endpoint %}{% set _ = url_args.update({'name': query}) %}{% endif %}
+            {% if request.endpoint == 'home' %}{% set _ = url_args.update({'q': request.args.get('q', '')}) %}{% endif %}
             
             {% if pagination.has_next %}<a href="{{ url_for(request.endpoint, **url_args) }}">Next &raquo;</a>{% endif %}
         </div>
@@ -342,6 +1554,10 @@ index_html = """
           {% endif %}
       {% endmacro %}
       
+      {% for shelf_title, movies_list in ranked_content or [] %}
+          {{ render_grid_section(shelf_title, movies_list) }}
+      {% endfor %}
+
       {{ render_grid_section('Latest Streams', latest_content) }}
       
       {% for cat_name, movies_list in categorized_content.items() %}
@@ -472,9 +1688,10 @@ detail_html = """
 
         {% if movie.type == 'movie' and movie.links %}
             {% for link_item in movie.links %}
-                {% if link_item.watch_url %}
+                {% if link_item.watch_url or link_item.file_id %}
                     {% set watch_title = quote(movie.title + ' ' + link_item.quality + ' Stream') %}
-                    <a href="{{ url_for('watch_online', target=quote(link_item.watch_url), title=watch_title) }}" class="stream-btn">
+                    {% set watch_href = url_for('watch_online', file=link_item.file_id, title=watch_title) if link_item.file_id else url_for('watch_online', target=quote(link_item.watch_url), title=watch_title) %}
+                    <a href="{{ watch_href }}" class="stream-btn">
                         <i class="fas fa-play"></i> Start Stream ({{ link_item.quality or 'HD' }})
                     </a>
                     {% break %} 
@@ -491,16 +1708,14 @@ detail_html = """
         
         {% if movie.type == 'series' %}
             <p style="color: var(--text-dark); margin-bottom: 15px;">Select an episode to begin streaming.</p>
-            {% set all_seasons = movie.episodes | map(attribute='season') | unique | sort %}
-            
-            {% for season_num in all_seasons %}
+            {% for season_num, episodes_for_season in seasons %}
                 <h3 style="color: var(--text-light); margin-top: 25px; margin-bottom: 10px;">Season {{ season_num }}</h3>
                 <div class="episode-list">
-                    {% set episodes_for_season = movie.episodes | selectattr('season', 'equalto', season_num) | list %}
-                    {% for ep in episodes_for_season | sort(attribute='episode_number') %}
-                        {% if ep.watch_link %}
+                    {% for ep in episodes_for_season %}
+                        {% if ep.watch_link or ep.file_id %}
                             {% set ep_title = quote(movie.title + ' S' + '%02d'|format(season_num|int) + ' E' + '%02d'|format(ep.episode_number|int)) %}
-                            <a href="{{ url_for('watch_online', target=quote(ep.watch_link), title=ep_title) }}" class="episode-item">
+                            {% set ep_href = url_for('watch_online', file=ep.file_id, title=ep_title) if ep.file_id else url_for('watch_online', target=quote(ep.watch_link), title=ep_title) %}
+                            <a href="{{ ep_href }}" class="episode-item">
                                 <span class="episode-title">{{ ep.episode_number }}. {{ ep.title or 'Episode ' + ep.episode_number|string }}</span>
                                 <span class="episode-info"><i class="fas fa-play-circle"></i> Watch</span>
                             </a>
@@ -641,6 +1856,7 @@ admin_html = """
 <h2>Configuration Steps:</h2>
 <ol>
     <li><p>Ensure <code>WEBSITE_URL</code> and <code>TELEGRAM_BOT_TOKEN</code> are set in Vercel.</p></li>
+    <li><p><strong>Run DB Migrations (once per deploy):</strong> <a href="{{ url_for('admin_migrate') }}" style="background: #333; color: white; padding: 10px; border-radius: 5px; text-decoration: none;">Seed Categories &amp; Create Indexes</a> (or <code>python app.py migrate</code>)</p></li>
     <li><p><strong>Run Webhook Setup (CRITICAL):</strong> <a href="{{ url_for('set_webhook') }}" style="background: #333; color: white; padding: 10px; border-radius: 5px; text-decoration: none;">Click to Set Telegram Webhook</a> (Requires Admin Login)</p></li>
 </ol>
 <h2>Note:</h2>
@@ -650,101 +1866,841 @@ admin_html = """
 """
 
 
+# =====================================================================
+# === [TEMPLATE REGISTRY] =============================================
+# =====================================================================
+
+class TemplateRegistry:
+    """Compiles every template string ONCE at import and renders via Template.render,
+    so requests never re-hash/re-parse the source the way render_template_string does."""
+    def __init__(self, flask_app):
+        self.app = flask_app; self._templates = {}; self._errors = {}
+
+    def register(self, name, source):
+        try: self._templates[name] = self.app.jinja_env.from_string(source)
+        except Exception as e:
+            # Keep the app importable; the error resurfaces when this template is rendered.
+            self._errors[name] = e
+            app.logger.error(f"Template '{name}' failed to compile: {e}")
+
+    def render(self, name, **context):
+        if name in self._errors: raise self._errors[name]
+        self.app.update_template_context(context)
+        return self._templates[name].render(context)
+
+templates = TemplateRegistry(app)
+for _name, _source in (("index", index_html), ("detail", detail_html), ("watch", watch_html), ("request", request_html), ("admin", admin_html)):
+    templates.register(_name, _source)
+
+@RequestTimings.timed("render")
+def render_page(name, **context): return templates.render(name, **context)
+
+
+# =====================================================================
+# === [RESPONSE CACHE] ================================================
+# =====================================================================
+
+PAGE_CACHE_BACKEND = os.environ.get("PAGE_CACHE_BACKEND", "memory")  # "memory" | "sqlite" | "off"
+PAGE_CACHE_PATH = os.environ.get("PAGE_CACHE_PATH", "/tmp/page_cache.sqlite3")
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 300))
+PAGE_CACHE_S_MAXAGE = int(os.environ.get("PAGE_CACHE_S_MAXAGE", 60))
+GENERATION_CHECK_INTERVAL = int(os.environ.get("GENERATION_CHECK_INTERVAL", 5))
+
+class CatalogueGeneration:
+    """Counter in settings.cache_version bumped on every catalogue write; re-read at most every few seconds."""
+    def __init__(self, check_interval=GENERATION_CHECK_INTERVAL):
+        self.check_interval = check_interval; self._value = 0; self._checked_at = 0.0
+
+    def current(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            try:
+                doc = settings.find_one({"_id": CACHE_VERSION_ID}, {"catalogue": 1}) or {}
+                self._value = doc.get("catalogue", 0); self._checked_at = now
+            except Exception as e: app.logger.error(f"Catalogue generation check failed: {e}")
+        return self._value
+
+    def bump(self):
+        self._checked_at = 0.0
+        doc = settings.find_one_and_update({"_id": CACHE_VERSION_ID}, {"$inc": {"catalogue": 1}}, upsert=True, return_document=True)
+        self._value = doc.get("catalogue", 0); self._checked_at = time.monotonic()
+
+catalogue_generation = CatalogueGeneration()
+
+def bump_catalogue_generation():
+    """Every catalogue write ends here: invalidates cached pages and queues a home snapshot rebuild."""
+    try: catalogue_generation.bump()
+    except Exception as e: app.logger.error(f"Failed to bump catalogue generation: {e}")
+    schedule_home_rebuild()
+
+
+class LRUResponseBackend:
+    def __init__(self, max_size=256):
+        self.max_size = max_size; self._entries = OrderedDict(); self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry: self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry; self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size: self._entries.popitem(last=False)
+
+
+class SQLiteResponseBackend:
+    """Single-node store that survives process restarts (e.g. a local/VPS deployment)."""
+    def __init__(self, path=PAGE_CACHE_PATH, max_rows=5000):
+        self.path = path; self.max_rows = max_rows
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS page_cache (key TEXT PRIMARY KEY, body BLOB, content_type TEXT, etag TEXT, stored_at REAL)")
+
+    def _connect(self): return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT body, content_type, etag, stored_at FROM page_cache WHERE key = ?", (key,)).fetchone()
+        return dict(zip(("body", "content_type", "etag", "stored_at"), row)) if row else None
+
+    def set(self, key, entry):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO page_cache VALUES (?, ?, ?, ?, ?)", (key, entry['body'], entry['content_type'], entry['etag'], entry['stored_at']))
+            conn.execute("DELETE FROM page_cache WHERE key NOT IN (SELECT key FROM page_cache ORDER BY stored_at DESC LIMIT ?)", (self.max_rows,))
+
+
+def _make_page_backend():
+    if PAGE_CACHE_BACKEND == "off": return None
+    if PAGE_CACHE_BACKEND == "sqlite":
+        try: return SQLiteResponseBackend()
+        except Exception as e: app.logger.error(f"SQLite page cache unavailable, using memory: {e}")
+    return LRUResponseBackend()
+
+page_cache = _make_page_backend()
+
+def cached_page(on_hit=None, shared=True):
+    """Full-response cache for public GET routes, keyed by generation + path + query args.
+    Adds ETag/Last-Modified and answers conditional requests with 304.
+    `on_hit(**view_args)` runs when the view function is skipped (e.g. to still count a view).
+    shared=False keeps the page out of the CDN (no s-maxage), so every view still reaches Flask and `on_hit`."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if page_cache is None: return f(*args, **kwargs)
+            generation = catalogue_generation.current()
+            key = f"{generation}:{request.path}?{urlencode(sorted(request.args.items(multi=True)))}"
+            entry = page_cache.get(key)
+            if entry and time.time() - entry['stored_at'] < PAGE_CACHE_TTL:
+                if on_hit: on_hit(**kwargs)
+            else:
+                rv = make_response(f(*args, **kwargs))
+                if rv.status_code != 200: return rv
+                body = rv.get_data()
+                entry = {"body": body, "content_type": rv.content_type, "etag": hashlib.sha1(body).hexdigest(), "stored_at": time.time()}
+                try: page_cache.set(key, entry)
+                except Exception as e: app.logger.error(f"Page cache write failed: {e}")
+            response = Response(entry['body'], content_type=entry['content_type'])
+            response.set_etag(entry['etag'])
+            response.last_modified = datetime.utcfromtimestamp(entry['stored_at'])
+            response.headers['Cache-Control'] = (f"public, max-age=0, s-maxage={PAGE_CACHE_S_MAXAGE}, stale-while-revalidate={PAGE_CACHE_S_MAXAGE}"
+                                                 if shared else "private, max-age=0")
+            return response.make_conditional(request)
+        return decorated
+    return decorator
+
+
+# =====================================================================
+# === [JOB QUEUE] =====================================================
+# =====================================================================
+
+JOB_QUEUE_BACKEND = os.environ.get("JOB_QUEUE_BACKEND", "mongo")  # "mongo" | "sqlite" (local testing)
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", "/tmp/job_queue.sqlite3")
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 60))
+JOB_BACKOFF_BASE = int(os.environ.get("JOB_BACKOFF_BASE", 5))
+JOB_DRAIN_BUDGET = float(os.environ.get("JOB_DRAIN_BUDGET", 8))
+JOB_INLINE_DRAIN = os.environ.get("JOB_INLINE_DRAIN", "1") == "1"
+
+def job_backoff(attempts):
+    delay = min(JOB_BACKOFF_BASE * 2 ** max(attempts - 1, 0), 600)
+    return delay + random.uniform(0, delay / 2)
+
+
+class MongoJobQueue:
+    """Jobs: pending -> running (leased) -> done | pending (retry with backoff) | dead (dead-letter).
+    A job whose lease expires (worker frozen/killed) becomes claimable again, unless that was its last attempt:
+    then reap() dead-letters it, since fail() never ran for it."""
+    def __init__(self, collection): self.collection = collection
+
+    def enqueue(self, kind, payload, job_id=None, delay=0):
+        """Returns False when a job with the same job_id already exists."""
+        now = datetime.utcnow()
+        job = {"_id": job_id or str(ObjectId()), "kind": kind, "payload": payload, "status": "pending", "attempts": 0,
+               "run_at": datetime.utcfromtimestamp(time.time() + delay), "created_at": now, "last_error": None}
+        try: self.collection.insert_one(job); return True
+        except DuplicateKeyError: return False
+
+    @staticmethod
+    def claim_query(now):
+        """(filter, sort): the oldest due pending job, or a running one whose lease expired with attempts left."""
+        return ({"$or": [{"status": "pending", "run_at": {"$lte": now}}, {"status": "running", "lease_until": {"$lt": now}, "attempts": {"$lt": JOB_MAX_ATTEMPTS}}]},
+                [("run_at", 1)])
+
+    @staticmethod
+    def reap_filter(now): return {"status": "running", "lease_until": {"$lt": now}, "attempts": {"$gte": JOB_MAX_ATTEMPTS}}
+
+    def claim(self):
+        query_filter, sort = self.claim_query(datetime.utcnow())
+        return self.collection.find_one_and_update(
+            query_filter, {"$set": {"status": "running", "lease_until": datetime.utcfromtimestamp(time.time() + JOB_LEASE_SECONDS)}, "$inc": {"attempts": 1}},
+            sort=sort, return_document=True)
+
+    def reap(self, error):
+        """Dead-letter one expired job that has used all its attempts; returns it (or None)."""
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            self.reap_filter(now), {"$set": {"status": "dead", "last_error": error, "finished_at": now}}, return_document=True)
+
+    def complete(self, job):
+        self.collection.update_one({"_id": job['_id']}, {"$set": {"status": "done", "finished_at": datetime.utcnow()}})
+
+    def fail(self, job, error):
+        dead = job['attempts'] >= JOB_MAX_ATTEMPTS
+        update = {"status": "dead" if dead else "pending", "last_error": str(error)[:500], "run_at": datetime.utcfromtimestamp(time.time() + job_backoff(job['attempts']))}
+        if dead: update["finished_at"] = datetime.utcnow()
+        self.collection.update_one({"_id": job['_id']}, {"$set": update})
+        return dead
+
+    def depth(self, status="pending"): return self.collection.count_documents({"status": status})
+
+
+class SQLiteJobQueue:
+    """Same contract as MongoJobQueue, for running the pipeline locally without Atlas."""
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, payload TEXT, status TEXT, attempts INTEGER, run_at REAL, lease_until REAL, last_error TEXT, created_at REAL)")
+
+    def _connect(self): return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def enqueue(self, kind, payload, job_id=None, delay=0):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute("INSERT INTO jobs VALUES (?, ?, ?, 'pending', 0, ?, NULL, NULL, ?)", (job_id or str(ObjectId()), kind, json.dumps(payload, default=str), now + delay, now))
+            return True
+        except sqlite3.IntegrityError: return False
+
+    def claim(self):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT id, kind, payload, attempts FROM jobs WHERE (status = 'pending' AND run_at <= ?) OR (status = 'running' AND lease_until < ? AND attempts < ?) ORDER BY run_at LIMIT 1",
+                               (now, now, JOB_MAX_ATTEMPTS)).fetchone()
+            if row: conn.execute("UPDATE jobs SET status = 'running', lease_until = ?, attempts = attempts + 1 WHERE id = ?", (now + JOB_LEASE_SECONDS, row[0]))
+            conn.execute("COMMIT")
+        finally: conn.close()
+        return {"_id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1} if row else None
+
+    def reap(self, error):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT id, kind, payload, attempts FROM jobs WHERE status = 'running' AND lease_until < ? AND attempts >= ? LIMIT 1", (now, JOB_MAX_ATTEMPTS)).fetchone()
+            if row: conn.execute("UPDATE jobs SET status = 'dead', last_error = ? WHERE id = ?", (error, row[0]))
+            conn.execute("COMMIT")
+        finally: conn.close()
+        return {"_id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3]} if row else None
+
+    def complete(self, job):
+        with self._connect() as conn: conn.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (job['_id'],))
+
+    def fail(self, job, error):
+        status = "dead" if job['attempts'] >= JOB_MAX_ATTEMPTS else "pending"
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, last_error = ?, run_at = ? WHERE id = ?", (status, str(error)[:500], time.time() + job_backoff(job['attempts']), job['_id']))
+        return status == "dead"
+
+    def depth(self, status="pending"):
+        with self._connect() as conn: return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+
+def _make_job_queue():
+    if JOB_QUEUE_BACKEND == "sqlite": return SQLiteJobQueue()
+    return MongoJobQueue(jobs_collection)
+
+job_queue = _make_job_queue()
+JOB_HANDLERS = {}
+JOB_DEAD_HANDLERS = {}
+
+def job_handler(kind, on_dead=None):
+    """Register `f(payload)` for `kind`; `on_dead(payload, error)` runs once if the job is dead-lettered."""
+    def decorator(f):
+        JOB_HANDLERS[kind] = f
+        if on_dead: JOB_DEAD_HANDLERS[kind] = on_dead
+        return f
+    return decorator
+
+def _run_dead_hook(job, error):
+    if job['kind'] not in JOB_DEAD_HANDLERS: return
+    try: JOB_DEAD_HANDLERS[job['kind']](job['payload'], error)
+    except Exception as dead_error: app.logger.error(f"Dead-letter hook for {job['_id']} failed: {dead_error}")
+
+def reap_expired_jobs():
+    """Dead-letter jobs whose last attempt lost its lease (crashed or froze the worker) and run their on_dead hooks."""
+    reaped = 0
+    while True:
+        error = TimeoutError(f"lease expired on attempt {JOB_MAX_ATTEMPTS}")
+        try: job = job_queue.reap(str(error))
+        except Exception as e: app.logger.error(f"Job reap failed: {e}"); return reaped
+        if not job: return reaped
+        app.logger.error(f"Job {job['_id']} ({job['kind']}) dead-lettered: {error}")
+        _run_dead_hook(job, error); reaped += 1
+
+def run_pending_jobs(time_budget=JOB_DRAIN_BUDGET, max_jobs=None):
+    """Drain due jobs until the queue is empty, the time budget runs out, or max_jobs is hit."""
+    deadline = time.monotonic() + time_budget if time_budget else None
+    processed = 0
+    reap_expired_jobs()
+    while (max_jobs is None or processed < max_jobs) and (deadline is None or time.monotonic() < deadline):
+        try: job = job_queue.claim()
+        except Exception as e: app.logger.error(f"Job claim failed: {e}"); break
+        if not job: break
+        handler = JOB_HANDLERS.get(job['kind'])
+        try:
+            if handler is None: raise RuntimeError(f"No handler for job kind '{job['kind']}'")
+            handler(job['payload'])
+            job_queue.complete(job)
+        except Exception as e:
+            app.logger.error(f"Job {job['_id']} ({job['kind']}) failed on attempt {job['attempts']}: {e}")
+            if job_queue.fail(job, e): _run_dead_hook(job, e)
+        processed += 1
+    return processed
+
+def enqueue_coalesced(kind, payload=None, delay=0, slot_seconds=5):
+    """At most one `kind` job per time slot; anything enqueued after a slot's job started lands in the next slot."""
+    slot = math.ceil((time.time() + delay) / slot_seconds)
+    return job_queue.enqueue(kind, payload or {}, job_id=f"{kind}:{slot}", delay=max(slot * slot_seconds - time.time(), 0))
+
+def drain_jobs_after_response(response):
+    if JOB_INLINE_DRAIN: response.call_on_close(run_pending_jobs)
+    return response
+
+def schedule_migrations(): job_queue.enqueue("migrate", {}, job_id=f"migrate:{INDEX_SPECS_VERSION}")  # once per INDEX_SPECS version
+
+@job_handler("migrate")
+def process_migrate(payload): run_migrations()
+
+def check_schema_version():
+    """Queue a migrate job when the database's indexes predate INDEX_SPECS (e.g. a fresh deploy nobody ran
+    `migrate` on). Runs from the /run_jobs tick and the worker, never on a visitor's request."""
+    try:
+        if (settings.find_one({"_id": SCHEMA_VERSION_ID}) or {}).get("indexes") != INDEX_SPECS_VERSION:
+            schedule_migrations(); return True
+    except Exception as e: app.logger.error(f"Schema version check failed: {e}")
+    return False
+
+
+class IngestDeduper:
+    """Records processed Telegram update_ids and video file_unique_ids so redeliveries and
+    re-forwards short-circuit before any network/DB work. An LRU of recently seen keys sits
+    in front of the TTL-indexed `ingest_dedup` collection; claiming is one insert_many whose
+    duplicate-key errors tell us the update was already ingested."""
+    def __init__(self, collection, lru_size=4096):
+        self.collection = collection; self.lru_size = lru_size
+        self._recent = OrderedDict(); self._lock = threading.Lock()
+        self.checks = 0; self.duplicates = 0; self.lru_hits = 0
+
+    def _remember(self, keys):
+        with self._lock:
+            for key in keys:
+                self._recent[key] = True; self._recent.move_to_end(key)
+            while len(self._recent) > self.lru_size: self._recent.popitem(last=False)
+
+    def claim(self, keys):
+        """True if this is the first time any of `keys` is seen; False for a duplicate."""
+        keys = [k for k in keys if k]
+        self.checks += 1
+        with self._lock: cached = any(k in self._recent for k in keys)
+        if cached:
+            self.lru_hits += 1; self.duplicates += 1
+            return False
+        if not keys: return True
+        now = datetime.utcnow()
+        try:
+            self.collection.insert_many([{"_id": k, "created_at": now} for k in keys], ordered=False)
+            fresh = True
+        except BulkWriteError as e:
+            fresh = not any(err.get('code') == 11000 for err in e.details.get('writeErrors', []))
+        self._remember(keys)
+        if not fresh: self.duplicates += 1
+        return fresh
+
+    def release(self, keys):
+        """Forget keys whose ingest never completed, so Telegram's redelivery or a re-forward is accepted again."""
+        keys = [k for k in keys if k]
+        with self._lock:
+            for key in keys: self._recent.pop(key, None)
+        if keys: self.collection.delete_many({"_id": {"$in": keys}})
+
+    def stats(self):
+        return {"checks": self.checks, "duplicates": self.duplicates, "lru_hits": self.lru_hits,
+                "hit_rate": round(self.duplicates / self.checks, 4) if self.checks else 0.0}
+
+ingest_deduper = IngestDeduper(ingest_dedup_collection)
+
+def ingest_keys(update_id, file_unique_id):
+    return [f"update:{update_id}" if update_id is not None else None, f"file:{file_unique_id}" if file_unique_id else None]
+
+def release_ingest_keys(payload, error):
+    app.logger.error(f"Ingest of update {payload.get('update_id')} dead-lettered, releasing dedup keys: {error}")
+    ingest_deduper.release(ingest_keys(payload.get('update_id'), payload['video'].get('file_unique_id')))
+
+
+@job_handler("telegram_video", on_dead=release_ingest_keys)
+def process_telegram_video(payload):
+    video = payload['video']
+    caption = payload.get('caption') or video.get('file_name') or 'Untitled Content'
+    stream_resolver.resolve_path(video['file_id'])  # validates the file is fetchable (getFile) and warms the cache
+
+    parsed = parse_caption(caption)
+    if parsed['season'] is not None and parsed['episode_number'] is not None:
+        return ingest_episode(parsed, caption, video)
+
+    content_title = caption.split('\n')[0].strip()
+    ingest_key = video.get('file_unique_id') or video['file_id']
+    movie_data = {
+        "ingest_key": ingest_key,
+        "title": content_title,
+        "type": "movie",
+        "language": "Bangla/Hindi", 
+        "categories": ["Trending"],
+        "view_count": 0,
+        "poster": PLACEHOLDER_POSTER,
+        "overview": caption,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+        "links": [{"quality": "HD", "watch_url": None, "file_id": video['file_id'], "file_unique_id": video.get('file_unique_id'), "download_url": None}],
+        "enrichment": {"status": "pending"}
+    }
+    # Upsert on the uploaded file so a retried or lease-expired job finds its earlier insert instead of duplicating the title;
+    # the follow-up jobs have deterministic ids, so re-running the tail is safe too.
+    result = movies.update_one({"ingest_key": ingest_key}, {"$setOnInsert": movie_data}, upsert=True)
+    if result.upserted_id is not None:
+        movie_id = movie_data['_id'] = result.upserted_id
+        count_provider.record_insert(movie_data)
+        home_snapshot_on_insert(movie_data)
+    else:
+        movie_id = movies.find_one({"ingest_key": ingest_key}, {"_id": 1})['_id']
+    bump_catalogue_generation()
+    job_queue.enqueue("enrich_metadata", {"movie_id": str(movie_id)}, job_id=f"enrich:{movie_id}")
+    # Delayed so the channel post usually goes out with the enriched poster/genres.
+    job_queue.enqueue("channel_notify", {"movie_id": str(movie_id)}, job_id=f"notify:{movie_id}", delay=ENRICH_NOTIFY_DELAY)
+    print(f"AUTO-POST SUCCESS: {movie_data['title']}")
+
+# --- Series / Episode Ingestion ---
+SERIES_NOTIFY_WINDOW = int(os.environ.get("SERIES_NOTIFY_WINDOW", 120))
+
+def series_key_for(title): return re.sub(r'\s+', ' ', title).strip().casefold()
+
+def ingest_episode(parsed, caption, video):
+    """Upsert one episode into its parent series document.
+    `episodes` is kept sorted server-side ($push/$sort) and `season_summary.<n>` holds an
+    incrementally maintained {count, first, last}, so readers never re-sort the episode list.
+    Channel posts for a burst of uploads are coalesced into one series_notify job."""
+    season, ep_num = parsed['season'], parsed['episode_number']
+    key = series_key_for(parsed['title']); now = datetime.utcnow()
+    series_doc = {
+        "title": parsed['title'], "series_key": key, "type": "series", "language": "Bangla/Hindi",
+        "categories": ["Trending"], "view_count": 0, "poster": PLACEHOLDER_POSTER, "overview": caption,
+        "created_at": now, "episodes": [], "season_summary": {}, "pending_notify": [], "enrichment": {"status": "pending"}
+    }
+    created = movies.update_one({"series_key": key}, {"$setOnInsert": series_doc}, upsert=True).upserted_id
+    episode = {"season": season, "episode_number": ep_num, "title": None, "watch_link": None,
+               "quality": (parsed['quality'] or ["HD"])[0], "file_id": video['file_id'], "file_unique_id": video.get('file_unique_id')}
+    added = movies.update_one(
+        {"series_key": key, "episodes": {"$not": {"$elemMatch": {"season": season, "episode_number": ep_num}}}},
+        {"$push": {"episodes": {"$each": [episode], "$sort": {"season": 1, "episode_number": 1}},
+                   "pending_notify": {"season": season, "episode_number": ep_num}},
+         "$inc": {f"season_summary.{season}.count": 1},
+         "$min": {f"season_summary.{season}.first": ep_num},
+         "$max": {f"season_summary.{season}.last": ep_num},
+         "$set": {"updated_at": now}}).modified_count
+    if not added:  # re-upload of an existing episode: just refresh its link
+        movies.update_one({"series_key": key}, {"$set": {"episodes.$[ep]": episode, "updated_at": now}},
+                          array_filters=[{"ep.season": season, "ep.episode_number": ep_num}])
+
+    series = movies.find_one_and_update({"series_key": key, "notify_scheduled": {"$ne": True}}, {"$set": {"notify_scheduled": True}}, {"_id": 1})
+    if created:
+        count_provider.record_insert(series_doc)
+        job_queue.enqueue("enrich_metadata", {"movie_id": str(created)}, job_id=f"enrich:{created}")
+    if series:
+        job_queue.enqueue("series_notify", {"movie_id": str(series['_id'])}, job_id=f"series_notify:{series['_id']}:{ObjectId()}", delay=SERIES_NOTIFY_WINDOW)
+    bump_catalogue_generation()
+    print(f"AUTO-POST SUCCESS: {parsed['title']} S{season:02d}E{ep_num:02d}")
+
+@job_handler("series_notify")
+def process_series_notify(payload):
+    """One "S01 [EP01-10 ADDED]" post for every episode that arrived during the window."""
+    series = movies.find_one_and_update({"_id": ObjectId(payload['movie_id'])}, {"$set": {"notify_scheduled": False}},
+                                        {"title": 1, "poster": 1, "language": 1, "genres": 1, "pending_notify": 1})
+    if not series or not series.get('pending_notify'): return
+    info = format_series_info(series['pending_notify'], None)
+    notification_dispatcher.enqueue(build_telegram_notification(series, series['_id'], 'update', info), series['_id'])
+    movies.update_one({"_id": series['_id']}, {"$pullAll": {"pending_notify": series['pending_notify']}})
+
+def group_episodes_by_season(movie):
+    """[(season, [episodes...]), ...] in order; only legacy documents without season_summary need a sort."""
+    episodes = movie.get('episodes') or []
+    if not movie.get('season_summary'):
+        episodes = sorted(episodes, key=lambda ep: (ep.get('season') or 0, ep.get('episode_number') or 0))
+    return [(season, list(eps)) for season, eps in groupby(episodes, key=lambda ep: ep.get('season'))]
+
+
+# --- Metadata Enrichment ---
+ENRICH_NOTIFY_DELAY = int(os.environ.get("ENRICH_NOTIFY_DELAY", 30))
+ENRICH_REQUEUE_INTERVAL = int(os.environ.get("ENRICH_REQUEUE_INTERVAL", 3600))
+
+class EnrichmentStats:
+    def __init__(self): self.processed = 0; self.matched = 0; self.latencies = deque(maxlen=500)
+
+    def record(self, elapsed, matched):
+        self.processed += 1; self.matched += int(matched); self.latencies.append(elapsed)
+
+    def stats(self):
+        window = sorted(self.latencies)
+        try: backlog = movies.count_documents({"enrichment.status": "pending"})
+        except Exception: backlog = None
+        return {"backlog": backlog, "processed": self.processed, "matched": self.matched, "p50_ms": percentile_ms(window, 0.5), "p95_ms": percentile_ms(window, 0.95)}
+
+enrichment_stats = EnrichmentStats()
+
+def enqueue_pending_enrichment(limit=500):
+    """Re-queue titles still marked pending (restart/recovery); existing jobs are skipped by job_id."""
+    queued = 0
+    for doc in movies.find({"enrichment.status": "pending"}, {"_id": 1}).limit(limit):
+        queued += job_queue.enqueue("enrich_metadata", {"movie_id": str(doc['_id'])}, job_id=f"enrich:{doc['_id']}")
+    return queued
+
+@job_handler("requeue_enrichment")
+def process_requeue_enrichment(payload): enqueue_pending_enrichment()
+
+def mark_enrichment_failed(payload, error):
+    """Dead-lettered titles leave `pending`, otherwise every requeue would keep retrying an existing job_id."""
+    movies.update_one({"_id": ObjectId(payload['movie_id']), "enrichment.status": "pending"},
+                      {"$set": {"enrichment": {"status": "failed", "error": str(error)[:500], "updated_at": datetime.utcnow()}}})
+
+@job_handler("enrich_metadata", on_dead=mark_enrichment_failed)
+def process_enrichment(payload):
+    """Caption -> TMDB match -> one $set with poster, backdrop, genres, release date and type."""
+    movie_id = ObjectId(payload['movie_id'])
+    if not TMDB_API_KEY:
+        movies.update_one({"_id": movie_id, "enrichment.status": "pending"}, {"$set": {"enrichment": {"status": "skipped", "updated_at": datetime.utcnow()}}})
+        return
+    start = time.perf_counter()
+    movie = movies.find_one({"_id": movie_id}, {"title": 1, "overview": 1, "type": 1, "categories": 1, "enrichment": 1})
+    if not movie or movie.get('enrichment', {}).get('status') != 'pending': return
+    parsed = parse_caption(movie.get('overview') or movie.get('title'))
+    media_type = "series" if parsed['season'] is not None else "movie"
+    tmdb_id = search_tmdb(parsed['title'], parsed['year'], media_type)
+    details = get_tmdb_details(tmdb_id, media_type) if tmdb_id else None
+
+    update = {"enrichment": {"status": "done" if details else "not_found", "parsed": parsed, "updated_at": datetime.utcnow()}}
+    if details:
+        update.update({field: details[field] for field in ("tmdb_id", "title", "poster", "backdrop", "genres", "release_date", "vote_average", "type") if details.get(field)})
+        if details.get('overview'): update['overview'] = details['overview']
+        if details.get('original_language') in LANGUAGE_NAMES: update['language'] = LANGUAGE_NAMES[details['original_language']]
+    movies.update_one({"_id": movie['_id']}, {"$set": update})
+
+    if update.get('type', movie.get('type')) != movie.get('type'):
+        count_provider.record_delete(movie); count_provider.record_insert({**movie, **update})
+    bump_catalogue_generation()
+    enrichment_stats.record(time.perf_counter() - start, bool(details))
+
+
+@job_handler("tmdb_refresh")
+def process_tmdb_refresh(payload):
+    details = fetch_tmdb_details(payload['tmdb_id'], payload['media_type'])
+    store_tmdb_details(payload['tmdb_id'], payload['media_type'], details)
+
+@job_handler("rebuild_home")
+def process_home_rebuild(payload):
+    rebuild_home_snapshot()
+    catalogue_generation.bump()  # cached pages must pick up the new snapshot (not bump_catalogue_generation: that would requeue us)
+
+@job_handler("compute_rankings")
+def process_compute_rankings(payload):
+    compute_rankings()
+    rebuild_home_snapshot()
+    catalogue_generation.bump()
+    job_queue.enqueue("prewarm_stream_links", {}, job_id=f"prewarm:{int(time.time())}")
+
+PREWARM_EPISODES_PER_TITLE = 10
+
+@job_handler("prewarm_stream_links")
+def process_prewarm_stream_links(payload):
+    """Resolve file paths for the trending titles ahead of time so their watch clicks are cache hits."""
+    ids = [item['_id'] for shelf in get_ranked_shelves() for item in shelf['items']]
+    file_ids = []
+    for doc in movies.find({"_id": {"$in": ids}}, {"links.file_id": 1, "episodes": {"$slice": -PREWARM_EPISODES_PER_TITLE}}):
+        file_ids += [link.get('file_id') for link in doc.get('links') or []]
+        file_ids += [ep.get('file_id') for ep in doc.get('episodes') or []]
+    for file_id in dict.fromkeys(filter(None, file_ids)):
+        stream_proxy.cache.mark_hot(file_id)
+        try: stream_resolver.resolve_path(file_id)
+        except Exception as e: app.logger.error(f"Prewarm failed for {file_id}: {e}")
+
+@job_handler("channel_notify")
+def process_channel_notify(payload):
+    movie = movies.find_one({"_id": ObjectId(payload['movie_id'])}, {"title": 1, "poster": 1, "language": 1, "genres": 1})
+    if movie: notification_dispatcher.enqueue(build_telegram_notification(movie, movie['_id']), movie['_id'])
+
+
+# --- Channel Notification Dispatcher ---
+NOTIFY_RATE_PER_MIN = float(os.environ.get("NOTIFY_RATE_PER_MIN", 20))
+NOTIFY_DIGEST = os.environ.get("NOTIFY_DIGEST", "1") == "1"
+NOTIFY_DIGEST_MIN = int(os.environ.get("NOTIFY_DIGEST_MIN", 3))
+NOTIFY_DIGEST_MAX = 10  # sendMediaGroup album limit
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", 5))
+
+class NotificationDispatcher:
+    """Persistent outbox for channel posts, drained under a per-chat token bucket.
+    When several posts are waiting they go out as one sendMediaGroup album (digest mode);
+    a 429 parks the chat's queue until Telegram's retry_after has passed."""
+    def __init__(self, collection):
+        self.collection = collection; self._buckets = {}; self._lock = threading.Lock()
+        self.sent = 0; self.rate_limited = 0; self.send_latencies = deque(maxlen=500); self.delivery_delays = deque(maxlen=500)
+
+    def _bucket(self, chat_id):
+        with self._lock:
+            if chat_id not in self._buckets: self._buckets[chat_id] = TokenBucket(NOTIFY_RATE_PER_MIN / 60, capacity=3)
+            return self._buckets[chat_id]
+
+    def enqueue(self, notification, movie_id, chat_id=None):
+        chat_id = chat_id or TELEGRAM_CHANNEL_ID
+        if not chat_id or not TELEGRAM_BOT_TOKEN or not WEBSITE_URL: return
+        now = datetime.utcnow()
+        self.collection.insert_one({**notification, "chat_id": chat_id, "movie_id": movie_id, "status": "pending", "attempts": 0, "not_before": now, "created_at": now})
+        schedule_notification_dispatch()
+
+    def _post(self, chat_id, group):
+        base = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+        if len(group) == 1:
+            item = group[0]
+            inline_keyboard = {"inline_keyboard": [[{"text": "▶️ Watch Now", "url": item['url']}]]}
+            payload = {'chat_id': chat_id, 'photo': item['photo'], 'caption': item['caption'], 'parse_mode': 'HTML', 'reply_markup': json.dumps(inline_keyboard)}
+            return http_client.post(f"{base}/sendPhoto", data=payload, timeout=15, retries=0)
+        # Albums can't carry inline keyboards, so each caption gets its own watch link.
+        media = [{"type": "photo", "media": item['photo'], "caption": f"{item['caption']}\n▶️ {html.escape(item['url'])}", "parse_mode": "HTML"} for item in group]
+        return http_client.post(f"{base}/sendMediaGroup", data={'chat_id': chat_id, 'media': json.dumps(media)}, timeout=15, retries=0)
+
+    @staticmethod
+    def pending_query(chat_id): return {"chat_id": chat_id, "status": "pending"}, [("created_at", 1)]
+
+    def dispatch(self):
+        """Send what the rate limit allows. Returns seconds until the next attempt is due, or None when drained."""
+        next_due = None
+        for chat_id in self.collection.distinct("chat_id", {"status": "pending"}):
+            bucket = self._bucket(chat_id)
+            while True:
+                now = datetime.utcnow()
+                query_filter, sort = self.pending_query(chat_id)
+                pending = list(self.collection.find(query_filter).sort(sort).limit(NOTIFY_DIGEST_MAX))
+                if not pending: break
+                if pending[0]['not_before'] > now:
+                    wait = (pending[0]['not_before'] - now).total_seconds()
+                    next_due = min(next_due or wait, wait); break
+                wait = bucket.try_acquire()
+                if wait:
+                    next_due = min(next_due or wait, wait); break
+                digestible = list(takewhile(lambda item: not item.get('solo'), pending))
+                group = digestible if NOTIFY_DIGEST and len(digestible) >= NOTIFY_DIGEST_MIN else pending[:1]
+                ids = [item['_id'] for item in group]
+                start = time.perf_counter()
+                try:
+                    res = self._post(chat_id, group)
+                    if res.status_code == 429:
+                        retry_after = OutboundHTTP._retry_after(res) or 30
+                        self.rate_limited += 1
+                        self.collection.update_many({"chat_id": chat_id, "status": "pending"}, {"$max": {"not_before": now + timedelta(seconds=retry_after)}})
+                        next_due = min(next_due or retry_after, retry_after); break
+                    if res.status_code == 400:
+                        # One bad caption/photo rejects a whole album: resend its items one by one, and
+                        # fail a single post outright since resending the same request can't succeed.
+                        app.logger.error(f"Telegram rejected a post to {chat_id}: {res.text[:200]}")
+                        if len(group) > 1: self.collection.update_many({"_id": {"$in": ids}}, {"$set": {"solo": True}})
+                        else: self.collection.update_one({"_id": ids[0]}, {"$set": {"status": "failed", "last_error": res.text[:500], "finished_at": now}})
+                        continue
+                    res.raise_for_status()
+                except requests.RequestException as e:
+                    app.logger.error(f"Channel notification to {chat_id} failed: {e}")
+                    for item in group:
+                        failed = item['attempts'] + 1 >= NOTIFY_MAX_ATTEMPTS
+                        update = {"status": "failed" if failed else "pending", "last_error": str(e)[:500], "not_before": now + timedelta(seconds=job_backoff(item['attempts'] + 1))}
+                        if failed: update["finished_at"] = now
+                        self.collection.update_one({"_id": item['_id']}, {"$inc": {"attempts": 1}, "$set": update})
+                    continue
+                elapsed = time.perf_counter() - start
+                self.collection.update_many({"_id": {"$in": ids}}, {"$set": {"status": "sent", "sent_at": datetime.utcnow(), "finished_at": datetime.utcnow(), "digest": len(group) > 1}})
+                self.sent += len(group); self.send_latencies.append(elapsed)
+                self.delivery_delays.extend((now - item['created_at']).total_seconds() for item in group)
+        return next_due
+
+    def stats(self):
+        pct = lambda values, q: round(sorted(values)[min(int(len(values) * q), len(values) - 1)], 3) if values else None
+        try: depth = self.collection.count_documents({"status": "pending"})
+        except Exception: depth = None
+        return {"outbox_depth": depth, "sent": self.sent, "rate_limited": self.rate_limited,
+                "send_p50_s": pct(self.send_latencies, 0.5), "send_p99_s": pct(self.send_latencies, 0.99), "delivery_delay_p50_s": pct(self.delivery_delays, 0.5)}
+
+notification_dispatcher = NotificationDispatcher(outbox_collection)
+
+def schedule_notification_dispatch(delay=0):
+    enqueue_coalesced("dispatch_notifications", delay=delay, slot_seconds=5)
+
+@job_handler("dispatch_notifications")
+def process_notification_dispatch(payload):
+    wait = notification_dispatcher.dispatch()
+    if wait is not None: schedule_notification_dispatch(delay=max(wait, 1))
+
+
 # =====================================================================
 # === [FLASK ROUTES - Final Robust Version] ===========================
 # =====================================================================
 
 @app.route('/')
+@cached_page()
 def home():
     try:
-        if movies is None: return "Server Error: Database connection failed.", 500
-        
         query = request.args.get('q', '').strip()
         
         if query:
-            query_filter = {"title": {"$regex": query, "$options": "i"}}
-            movies_list = list(movies.find(query_filter).sort('updated_at', -1).limit(ITEMS_PER_PAGE))
-            total_results = movies.count_documents(query_filter)
-            pagination = Pagination(1, ITEMS_PER_PAGE, total_results)
+            page = max(request.args.get('page', 1, type=int), 1)
+            movies_list, pagination = search_content(query, page)
             
-            return render_template_string(index_html, movies=movies_list, query=f'Results for "{query}"', is_full_page_list=True, pagination=pagination)
+            return render_page('index', movies=movies_list, query=f'Results for "{query}"', is_full_page_list=True, pagination=pagination)
 
-        slider_content = list(movies.find({}).sort('updated_at', -1).limit(8))
-        latest_content = list(movies.find({}).sort('created_at', -1).limit(10))
-        
-        home_categories = [cat['name'] for cat in categories_collection.find().sort("name", 1)]
-        categorized_content = {}
-        for cat in home_categories:
-            cat_movies = list(movies.find({"categories": cat}).sort('updated_at', -1).limit(10))
-            if cat_movies:
-                categorized_content[cat] = cat_movies
+        slider_content, latest_content, categorized_content, ranked_content = get_home_snapshot()
         
         context = {
             "slider_content": slider_content, 
             "latest_content": latest_content,
+            "ranked_content": ranked_content,
             "categorized_content": categorized_content, 
             "is_full_page_list": False, 
             "pagination": None
         }
-        return render_template_string(index_html, **context)
+        return render_page('index', **context)
     
     except Exception as e:
         app.logger.error(f"Error loading homepage: {e}", exc_info=True)
         return "Server Error: An unexpected error occurred while loading content. Check server logs.", 500
 
 
+def _record_cached_view(movie_id):
+    try: view_counter.record(ObjectId(movie_id))
+    except Exception: pass
+
 @app.route('/movie/<movie_id>')
+@cached_page(on_hit=_record_cached_view, shared=False)  # edge hits would skip the view count
 def movie_detail(movie_id):
     try:
-        if movies is None: return "Content not found (DB Error)", 500
-        movie = movies.find_one_and_update(
-            {"_id": ObjectId(movie_id)},
-            {"$inc": {"view_count": 1}},
-            return_document=True
-        )
+        movie = movies.find_one({"_id": ObjectId(movie_id)}, PROJECTIONS["detail"])
         if not movie: return "Content not found", 404
-        return render_template_string(detail_html, movie=movie)
+        view_counter.record(movie['_id'])
+        seasons = group_episodes_by_season(movie) if movie.get('type') == 'series' else []
+        return render_page('detail', movie=movie, seasons=seasons)
     except Exception as e:
         app.logger.error(f"Error in movie_detail: {e}")
         return "Content not found", 404
 
-def get_paginated_content(query_filter, page):
-    if movies is None: return [], Pagination(1, ITEMS_PER_PAGE, 0)
-    skip = (page - 1) * ITEMS_PER_PAGE
-    total_count = movies.count_documents(query_filter)
-    content_list = list(movies.find(query_filter).sort('updated_at', -1).skip(skip).limit(ITEMS_PER_PAGE))
-    pagination = Pagination(page, ITEMS_PER_PAGE, total_count)
+# --- Keyset (cursor) pagination on (updated_at, _id) ---
+def encode_cursor(doc, direction, page):
+    if not isinstance(doc.get('updated_at'), datetime): return None
+    payload = {"u": doc['updated_at'].isoformat(), "i": str(doc['_id']), "d": direction, "p": page}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    if not token: return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return {"updated_at": datetime.fromisoformat(payload['u']), "_id": ObjectId(payload['i']), "forward": payload['d'] == 'next', "page": max(int(payload['p']), 1)}
+    except Exception:
+        return None
+
+def keyset_query(query_filter, cursor=None):
+    """(filter, sort) for a list page: newest first, or seeking past a decoded cursor (backwards for prev links)."""
+    if not cursor: return query_filter, [('updated_at', -1), ('_id', -1)]
+    op, order = ("$lt", -1) if cursor['forward'] else ("$gt", 1)
+    keyset = {"$or": [{"updated_at": {op: cursor['updated_at']}}, {"updated_at": cursor['updated_at'], "_id": {op: cursor['_id']}}]}
+    return {"$and": [query_filter, keyset]}, [('updated_at', order), ('_id', order)]
+
+def get_paginated_content(query_filter, page, cursor_token=None):
+    """Cursor tokens seek straight to the page via the (filter, updated_at, _id) indexes.
+    Plain ?page=N links (old URLs, crawlers) still work through skip."""
+    page = max(page, 1)
+    total_count = count_provider.count(query_filter)
+    cursor = decode_cursor(cursor_token)
+    seek_filter, sort = keyset_query(query_filter, cursor)
+    if cursor:
+        page = cursor['page']
+        content_list = list(movies.find(seek_filter, PROJECTIONS["card"]).sort(sort).limit(ITEMS_PER_PAGE))
+        if not cursor['forward']: content_list.reverse()
+    else:
+        skip = (page - 1) * ITEMS_PER_PAGE
+        content_list = list(movies.find(seek_filter, PROJECTIONS["card"]).sort(sort).skip(skip).limit(ITEMS_PER_PAGE))
+    next_cursor = encode_cursor(content_list[-1], 'next', page + 1) if content_list else None
+    prev_cursor = encode_cursor(content_list[0], 'prev', page - 1) if content_list and page > 1 else None
+    pagination = Pagination(page, ITEMS_PER_PAGE, total_count, next_cursor, prev_cursor, has_more=len(content_list) == ITEMS_PER_PAGE)
     return content_list, pagination
 
 @app.route('/movies')
+@cached_page()
 def all_movies():
     page = request.args.get('page', 1, type=int)
-    content, pagination = get_paginated_content({"type": "movie"}, page)
-    return render_template_string(index_html, movies=content, query="All Movies", is_full_page_list=True, pagination=pagination)
+    content, pagination = get_paginated_content({"type": "movie"}, page, request.args.get('cursor'))
+    return render_page('index', movies=content, query="All Movies", is_full_page_list=True, pagination=pagination)
 
 @app.route('/series')
+@cached_page()
 def all_series():
     page = request.args.get('page', 1, type=int)
-    content, pagination = get_paginated_content({"type": "series"}, page)
-    return render_template_string(index_html, movies=content, query="All Series", is_full_page_list=True, pagination=pagination)
+    content, pagination = get_paginated_content({"type": "series"}, page, request.args.get('cursor'))
+    return render_page('index', movies=content, query="All Series", is_full_page_list=True, pagination=pagination)
 
 @app.route('/category')
+@cached_page()
 def movies_by_category():
     title = request.args.get('name')
     if not title: return redirect(url_for('home'))
     page = request.args.get('page', 1, type=int)
-    content, pagination = get_paginated_content({"categories": title}, page)
-    return render_template_string(index_html, movies=content, query=title, is_full_page_list=True, pagination=pagination)
+    content, pagination = get_paginated_content({"categories": title}, page, request.args.get('cursor'))
+    return render_page('index', movies=content, query=title, is_full_page_list=True, pagination=pagination)
 
 
 # --- Stream Specific Routes ---
 @app.route('/watch')
 def watch_online():
     encoded_url = request.args.get('target')
+    file_id = request.args.get('file')
     title = request.args.get('title', 'Content')
-    if not encoded_url: return redirect(url_for('home'))
-    url_to_embed = unquote(encoded_url)
-    return render_template_string(watch_html, url=url_to_embed, title=unquote(title))
+    if file_id:
+        # Webhook content stores only the Telegram file_id; it plays through the same-origin proxy,
+        # which resolves the (expiring, bot-token) file URL server-side.
+        url_to_embed = url_for('stream_file', file_id=file_id)
+    elif encoded_url:
+        url_to_embed = unquote(encoded_url)
+    else:
+        return redirect(url_for('home'))
+    return render_page('watch', url=url_to_embed, title=unquote(title))
+
+@app.route('/stream/<file_id>')
+def stream_file(file_id):
+    """Range-aware relay of a Telegram file; see StreamProxy."""
+    return stream_proxy.serve(file_id, request.headers.get('Range'))
 
 
 # --- TELEGRAM WEBHOOK HANDLERS ---
@@ -757,7 +2713,7 @@ def set_webhook():
         
     webhook_url = f"{WEBSITE_URL}/telegram_update"
     api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook"
-    response = requests.get(api_url, params={'url': webhook_url})
+    response = http_client.get(api_url, params={'url': webhook_url}, timeout=10)
     
     if response.ok and response.json().get('ok'):
         return f"SUCCESS: Webhook set to: {webhook_url}", 200
@@ -768,87 +2724,706 @@ def set_webhook():
 
 @app.route('/telegram_update', methods=['POST'])
 def telegram_update():
-    data = request.json
+    """Validate, enqueue and ack immediately; file resolution, insert and channel post run as jobs."""
+    data = request.get_json(silent=True) or {}
     
     message = data.get('message')
-    if not message or movies is None: return jsonify(success=True)
+    if not message or not TELEGRAM_BOT_TOKEN: return jsonify(success=True)
     
     video = message.get('video')
-    
-    if not video: return jsonify(success=True) 
+    if not video or not video.get('file_id'): return jsonify(success=True) 
 
-    file_id = video.get('file_id')
-    caption = message.get('caption', video.get('file_name', 'Untitled Content'))
-    
-    # --- 1. Generate Direct Stream Link (Using Telegram API) ---
-    if not TELEGRAM_BOT_TOKEN: return jsonify(success=True)
-        
-    def get_file_path(token, file_id):
-        try:
-            url = f"https://api.telegram.org/bot{token}/getFile?file_id={file_id}"
-            res = requests.get(url, timeout=5).json()
-            return res.get('result', {}).get('file_path')
-        except: return None
-        
-    file_path = get_file_path(TELEGRAM_BOT_TOKEN, file_id)
-    stream_link = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}" if file_path else None
-    
-    if not stream_link:
-        app.logger.warning("Stream link could not be generated.")
-        return jsonify(success=True)
-
-    # --- 2. Extract Metadata & Insert ---
-    content_title = caption.split('\n')[0].strip()
-    
-    movie_data = {
-        "title": content_title,
-        "type": "movie",
-        "language": "Bangla/Hindi", 
-        "categories": ["Trending"],
-        "view_count": 0,
-        "poster": PLACEHOLDER_POSTER,
-        "overview": caption,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
-        "links": [{"quality": "HD", "watch_url": stream_link, "download_url": None}]
-    }
-    
+    payload = {"update_id": data.get('update_id'), "caption": message.get('caption'),
+               "video": {"file_id": video['file_id'], "file_unique_id": video.get('file_unique_id'), "file_name": video.get('file_name')}}
+    keys = ingest_keys(data.get('update_id'), video.get('file_unique_id'))
     try:
-        result = movies.insert_one(movie_data)
-        if result.inserted_id: send_telegram_notification(movie_data, result.inserted_id, notification_type='new')
-        print(f"AUTO-POST SUCCESS: {movie_data['title']}")
-        return jsonify(success=True)
+        if not ingest_deduper.claim(keys): return jsonify(success=True, duplicate=True)
+    except Exception as e: app.logger.error(f"Ingest dedup check failed: {e}")
+
+    job_id = f"tg:{data['update_id']}" if data.get('update_id') is not None else None
+    try: job_queue.enqueue("telegram_video", payload, job_id=job_id)
     except Exception as e:
-        app.logger.error(f"DB Insert Error during Webhook: {e}")
-        return jsonify(success=True) 
+        app.logger.error(f"Failed to enqueue Telegram update: {e}")
+        try: ingest_deduper.release(keys)
+        except Exception as release_error: app.logger.error(f"Failed to release dedup keys: {release_error}")
+        return jsonify(success=False), 503  # non-2xx makes Telegram redeliver the update
+    return drain_jobs_after_response(jsonify(success=True))
+
+
+@app.route('/run_jobs', methods=['GET', 'POST'])
+def run_jobs():
+    """Worker tick for a cron/uptime pinger: /run_jobs?secret=AUTO_POST_SECRET"""
+    if request.args.get('secret') != AUTO_POST_SECRET: return "Forbidden", 403
+    check_schema_version()
+    enqueue_coalesced("requeue_enrichment", slot_seconds=ENRICH_REQUEUE_INTERVAL)  # recovery sweep, not on every ping
+    enqueue_coalesced("compute_rankings", slot_seconds=TRENDING_INTERVAL)
+    processed = run_pending_jobs()
+    return jsonify(processed=processed, pending=job_queue.depth(),
+                   dedup=ingest_deduper.stats(), enrichment=enrichment_stats.stats(), notifications=notification_dispatcher.stats())
+
+@app.route('/metrics')
+@requires_auth
+def metrics():
+    """Per-route latency percentiles, Mongo command totals and the in-process component stats."""
+    try: pending = job_queue.depth()
+    except Exception: pending = None
+    return jsonify(routes=route_metrics.stats(), mongo=mongo_command_timer.stats(), http=http_client.stats(),
+                   stream=stream_proxy.stats(), resolver=stream_resolver.stats(), counts=count_provider.stats(),
+                   site_cache=site_cache.stats(), views=view_counter.stats(), dedup=ingest_deduper.stats(),
+                   enrichment=enrichment_stats.stats(), notifications=notification_dispatcher.stats(), pending_jobs=pending,
+                   profiles=slow_request_profiler.dumps if slow_request_profiler else None)
 
 # --- Admin Routes (Simplified, functional for demonstration) ---
 
 @app.route('/admin', methods=["GET", "POST"])
 @requires_auth
 def admin():
-    return render_template_string(admin_html, website_name=WEBSITE_NAME)
+    return render_page('admin', website_name=WEBSITE_NAME)
+
+@app.route('/admin/migrate')
+@requires_auth
+def admin_migrate():
+    try: report = run_migrations()
+    except Exception as e:
+        app.logger.error(f"Migration failed: {e}")
+        return f"FAILURE: Migration failed: {e}", 500
+    invalidate_site_config()
+    lines = "\n".join(f"{action:>10}  {collection_name}.{name}" for collection_name, name, action in report)
+    return Response(f"SUCCESS: Categories seeded and indexes reconciled.\n\n{lines}\n", 200, mimetype="text/plain")
 
 @app.route('/delete_movie/<movie_id>')
 @requires_auth
 def delete_movie(movie_id):
-    if movies is None: return redirect(url_for('admin'))
-    try: movies.delete_one({"_id": ObjectId(movie_id)})
+    try:
+        deleted = movies.find_one_and_delete({"_id": ObjectId(movie_id)})
+        if deleted:
+            count_provider.record_delete(deleted); home_snapshot_on_delete(deleted['_id']); bump_catalogue_generation()
     except: pass
     return redirect(url_for('admin'))
 
 @app.route('/request', methods=['GET', 'POST'])
 def request_content():
-    if request.method == 'POST' and requests_collection is not None:
+    if request.method == 'POST':
         content_name = request.form.get('content_name', '').strip()
         extra_info = request.form.get('extra_info', '').strip()
         if content_name:
             requests_collection.insert_one({"name": content_name, "info": extra_info, "status": "Pending", "created_at": datetime.utcnow()})
             flash('Your request has been submitted successfully!', 'success')
         return redirect(url_for('request_content'))
-    return render_template_string(request_html)
+    return render_page('request')
+
+
+def run_worker(poll_interval=2):
+    """Long-running worker for non-serverless deployments: python app.py worker"""
+    print("Job worker started.")
+    check_schema_version()
+    while True:
+        enqueue_coalesced("compute_rankings", slot_seconds=TRENDING_INTERVAL)
+        if not run_pending_jobs(time_budget=None, max_jobs=100): time.sleep(poll_interval)
+
+
+# =====================================================================
+# === [CATALOGUE IMPORT / EXPORT] =====================================
+# =====================================================================
+
+CATALOGUE_BATCH_SIZE = int(os.environ.get("CATALOGUE_BATCH_SIZE", 1000))
+CATALOGUE_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.RELAXED, tz_aware=False)  # ObjectId/dates round-trip as $oid/$date
+
+def _read_checkpoint(path):
+    try:
+        with open(path) as f: return json.load(f)
+    except (OSError, ValueError): return None
+
+def _write_checkpoint(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f: json.dump(state, f)
+    os.replace(tmp, path)
+
+class ProgressReporter:
+    """Throttled "N docs, X/s" lines on stderr for long CLI runs."""
+    def __init__(self, label, every=5.0): self.label = label; self.every = every; self.started = self._last = time.monotonic(); self.done = 0
+
+    def advance(self, count, **extra):
+        self.done += count; now = time.monotonic()
+        if now - self._last >= self.every: self._last = now; self.report(**extra)
+
+    def report(self, **extra):
+        elapsed = time.monotonic() - self.started
+        details = "".join(f"  {key} {value}" for key, value in extra.items())
+        print(f"{self.label}: {self.done} docs in {elapsed:.1f}s ({self.done / elapsed if elapsed else 0:.0f}/s){details}", file=sys.stderr)
+
+def catalogue_upsert_filter(doc):
+    """Natural key for an imported document: series key, then TMDB id, then a link's file_unique_id, then _id.
+    Series go by series_key first: it is unique, and the target may hold the series un-enriched (no tmdb_id yet)."""
+    if doc.get('series_key'): return {"series_key": doc['series_key']}
+    if doc.get('tmdb_id') is not None: return {"tmdb_id": doc['tmdb_id'], "type": doc.get('type', 'movie')}
+    file_ids = [link['file_unique_id'] for link in doc.get('links') or [] if link.get('file_unique_id')]
+    if file_ids: return {"links.file_unique_id": file_ids[0]}
+    if doc.get('_id') is not None: return {"_id": doc['_id']}
+    return None
+
+def _catalogue_op(doc):
+    doc_id = doc.pop('_id', None)
+    key = catalogue_upsert_filter({**doc, "_id": doc_id})
+    if key is None: return InsertOne(doc)
+    # $setOnInsert keeps exported ObjectIds (and so /movie/<id> URLs) on a fresh database without touching existing _ids.
+    update = {"$set": doc}
+    if doc_id is not None and "_id" not in key: update["$setOnInsert"] = {"_id": doc_id}
+    return UpdateOne(key, update, upsert=True)
+
+def import_catalogue(path, batch_size=CATALOGUE_BATCH_SIZE, ordered=False, resume=False):
+    """Stream a JSONL file into `movies` as bulk_write batches of natural-key upserts.
+    Memory is bounded by one batch; after each batch the byte offset is checkpointed to <path>.checkpoint,
+    so --resume after a crash continues after the last committed batch. A finished run removes the checkpoint."""
+    checkpoint_path = f"{path}.checkpoint"
+    state = (_read_checkpoint(checkpoint_path) if resume else None) or {"offset": 0, "line": 0}
+    totals = Counter(); progress = ProgressReporter("import")
+    with open(path, "rb") as f:
+        f.seek(state['offset'])
+        offset, line_no, ops = state['offset'], state['line'], []
+
+        def flush():
+            if ops:
+                try: result = movies.bulk_write(ops, ordered=ordered).bulk_api_result
+                except BulkWriteError as e:
+                    result = e.details; totals['errors'] += len(result.get('writeErrors', []))
+                    for error in result.get('writeErrors', [])[:3]: app.logger.error(f"Import write error: {error.get('errmsg')}")
+                    if ordered: raise
+                totals['inserted'] += result.get('nInserted', 0); totals['upserted'] += result.get('nUpserted', 0); totals['modified'] += result.get('nModified', 0)
+                progress.advance(len(ops), upserted=totals['upserted'], modified=totals['modified'], errors=totals['errors'])
+                ops.clear()
+            _write_checkpoint(checkpoint_path, {"offset": offset, "line": line_no})
+
+        for raw in f:
+            offset += len(raw); line_no += 1
+            if not raw.strip(): continue
+            try: ops.append(_catalogue_op(json_util.loads(raw, json_options=CATALOGUE_JSON_OPTIONS)))
+            except Exception as e:
+                totals['invalid'] += 1; app.logger.error(f"Skipping line {line_no}: {e}"); continue
+            if len(ops) >= batch_size: flush()
+        flush()
+    os.remove(checkpoint_path)
+    progress.report(**totals)
+    if totals['inserted'] or totals['upserted'] or totals['modified']:
+        rebuild_home_snapshot(); catalogue_generation.bump()
+    return dict(totals, lines=line_no)
+
+def export_catalogue(path, batch_size=CATALOGUE_BATCH_SIZE, query_filter=None, resume=False):
+    """Write `movies` as JSONL from an _id-ordered, batched cursor using the export projection.
+    With a file target the last written _id and file size are checkpointed per batch; --resume truncates
+    to that size and continues with _id > last, so a partial line is never left behind. path "-" is stdout."""
+    to_stdout = path == "-"
+    checkpoint_path = f"{path}.checkpoint"
+    state = (_read_checkpoint(checkpoint_path) if resume and not to_stdout else None) or {}
+    query = dict(query_filter or {})
+    if state.get('last_id'): query["_id"] = {"$gt": json_util.loads(state['last_id'])}
+    progress = ProgressReporter("export")
+    out = sys.stdout.buffer if to_stdout else open(path, "r+b" if state else "wb")
+    try:
+        if state: out.seek(state['size']); out.truncate()
+        cursor = movies.find(query, PROJECTIONS["export"]).sort("_id", 1).batch_size(batch_size)
+        written = state.get('written', 0); buffered = []
+        for doc in cursor:
+            buffered.append(json_util.dumps(doc, json_options=CATALOGUE_JSON_OPTIONS).encode() + b"\n")
+            if len(buffered) >= batch_size:
+                out.writelines(buffered); written += len(buffered); progress.advance(len(buffered)); buffered = []
+                if not to_stdout:
+                    out.flush()
+                    _write_checkpoint(checkpoint_path, {"last_id": json_util.dumps(doc['_id']), "size": out.tell(), "written": written})
+        if buffered: out.writelines(buffered); written += len(buffered); progress.advance(len(buffered))
+        out.flush()
+    finally:
+        if not to_stdout: out.close()
+    if not to_stdout and os.path.exists(checkpoint_path): os.remove(checkpoint_path)
+    progress.report()
+    return written
+
+def run_catalogue_cli(argv):
+    """python app.py catalogue import|export <path> [--batch N] [--resume] [--ordered] [--type movie|series]"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="app.py catalogue")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("path", help='JSONL file ("-" exports to stdout)')
+    parser.add_argument("--batch", type=int, default=CATALOGUE_BATCH_SIZE)
+    parser.add_argument("--resume", action="store_true", help="continue from <path>.checkpoint")
+    parser.add_argument("--ordered", action="store_true", help="import: stop at the first failed write")
+    parser.add_argument("--type", choices=["movie", "series"], help="export: only this content type")
+    args = parser.parse_args(argv)
+    if args.action == "import":
+        if args.path == "-": parser.error("import needs a file path (offsets are checkpointed)")
+        print(json.dumps(import_catalogue(args.path, args.batch, ordered=args.ordered, resume=args.resume)))
+    else:
+        count = export_catalogue(args.path, args.batch, {"type": args.type} if args.type else None, resume=args.resume)
+        print(f"Exported {count} documents.", file=sys.stderr)
+
+
+# =====================================================================
+# === [BENCHMARK] =====================================================
+# =====================================================================
+
+BENCH_WORDS = ["shadow", "river", "night", "king", "love", "city", "storm", "dream", "fire", "ghost", "road", "secret", "moon", "hunter", "game", "star"]
+BENCH_GENRES = ["Action", "Drama", "Comedy", "Thriller", "Romance", "Horror", "Crime", "Animation"]
+BENCH_LANGUAGES = ["Bangla", "Hindi", "English", "Tamil", "Korean"]
+BENCH_FILE = bytes(range(256)) * (32 * 1024)  # 8 MiB stand-in for every Telegram-hosted video
+
+class BenchStubAdapter(HTTPAdapter):
+    """In-process stand-in for api.telegram.org / api.themoviedb.org, mounted on http_client's sessions,
+    so the benchmark exercises the real client code paths without network or real tokens."""
+    def __init__(self, latency=0.0):
+        super().__init__(); self.latency = latency; self.calls = Counter()
+
+    def send(self, request_, **kwargs):
+        if self.latency: time.sleep(self.latency)
+        url = urlparse(request_.url); path = url.path; status = 200
+        if path.startswith("/file/bot"): return self._file(request_)
+        if "/getFile" in path: body = {"ok": True, "result": {"file_path": f"videos/{hashlib.sha1(url.query.encode()).hexdigest()[:12]}.mp4"}}
+        elif "/send" in path: body = {"ok": True, "result": {"message_id": random.randint(1, 10 ** 6)}}
+        elif path.startswith("/3/search/"): body = {"results": [{"id": random.randint(1, 10 ** 6)}]}
+        elif path.startswith("/3/"):
+            tmdb_id = path.rsplit("/", 1)[-1]
+            body = {"id": tmdb_id, "title": f"Title {tmdb_id}", "name": f"Title {tmdb_id}", "overview": "Synthetic overview.", "poster_path": f"/{tmdb_id}.jpg",
+                    "backdrop_path": f"/{tmdb_id}-b.jpg", "release_date": "2020-01-01", "genres": [{"name": random.choice(BENCH_GENRES)}], "vote_average": 7.0, "original_language": "bn"}
+        else: body = {"ok": False}; status = 404
+        self.calls[url.netloc] += 1
+        response = requests.Response()
+        response.status_code = status; response.url = request_.url; response.request = request_
+        response._content = json.dumps(body).encode(); response.headers["Content-Type"] = "application/json"
+        return response
+
+    def _file(self, request_):
+        """BENCH_FILE with Range support, in the shape the Telegram file endpoint answers."""
+        self.calls["file"] += 1
+        response = requests.Response(); response.url = request_.url; response.request = request_
+        match = RANGE_RE.match(request_.headers.get("Range", "")); total = len(BENCH_FILE)
+        if not match: response.status_code = 200; body = BENCH_FILE
+        else:
+            start = int(match.group(1)); end = min(int(match.group(2)) if match.group(2) else total - 1, total - 1)
+            response.status_code = 206 if start < total else 416; body = BENCH_FILE[start:end + 1]
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{total}" if start < total else f"bytes */{total}"
+        response._content = body; response._content_consumed = True  # iter_content then slices the body
+        response.headers["Content-Type"] = "video/mp4"; response.headers["Content-Length"] = str(len(body))
+        return response
+
+def install_bench_stubs(latency=0.0):
+    adapter = BenchStubAdapter(latency)
+    for host in ("https://api.telegram.org/", "https://api.themoviedb.org/"):
+        http_client.client(host).session.mount("https://", adapter)
+    return adapter
+
+def _bench_title(i): return f"{BENCH_WORDS[i % len(BENCH_WORDS)].title()} {BENCH_WORDS[(i // len(BENCH_WORDS)) % len(BENCH_WORDS)].title()} {i}"
+
+def bench_documents(titles, series_ratio, episodes, categories, start=0):
+    """Synthetic catalogue in the shape the ingest handlers write, generated lazily (titles start..start+titles-1)."""
+    now = datetime.utcnow()
+    for i in range(start, start + titles):
+        created = now - timedelta(minutes=i)
+        doc = {"title": _bench_title(i), "language": BENCH_LANGUAGES[i % len(BENCH_LANGUAGES)], "categories": random.sample(categories, min(2, len(categories))),
+               "genres": random.sample(BENCH_GENRES, 2), "view_count": int(random.paretovariate(1.2) * 10), "poster": PLACEHOLDER_POSTER, "backdrop": PLACEHOLDER_POSTER,
+               "overview": f"Synthetic title {i} about a {random.choice(BENCH_WORDS)} and a {random.choice(BENCH_WORDS)}.", "tmdb_id": 100000 + i,
+               "release_date": f"{1990 + i % 35}-01-01", "vote_average": round(random.uniform(4, 9), 1), "created_at": created, "updated_at": created,
+               "enrichment": {"status": "done"}}
+        if random.random() < series_ratio:
+            seasons = max(1, episodes // 10)
+            eps = [{"season": s, "episode_number": e, "title": None, "watch_link": None, "quality": "720p", "file_id": f"bench-{i}-{s}-{e}", "file_unique_id": f"bu-{i}-{s}-{e}"}
+                   for s in range(1, seasons + 1) for e in range(1, episodes // seasons + 1)]
+            doc.update(type="series", series_key=series_key_for(doc['title']), episodes=eps, pending_notify=[],
+                       season_summary={str(s): {"count": episodes // seasons, "first": 1, "last": episodes // seasons} for s in range(1, seasons + 1)})
+        else:
+            doc.update(type="movie", links=[{"quality": "HD", "watch_url": None, "file_id": f"bench-{i}", "file_unique_id": f"bu-{i}", "download_url": None}])
+        yield doc
+
+def insert_bench_documents(docs, batch_size=5000):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size: movies.insert_many(batch, ordered=False); batch = []
+    if batch: movies.insert_many(batch, ordered=False)
+
+def seed_bench_catalogue(titles, series_ratio=0.2, episodes=20, category_count=7, batch_size=5000):
+    get_mongo_client().drop_database(MONGO_DB_NAME)
+    categories = ["Trending", "Series"] + [f"{genre}" for genre in BENCH_GENRES][:max(0, category_count - 2)]
+    categories_collection.insert_many([{"name": name} for name in categories])
+    started = time.perf_counter()
+    insert_bench_documents(bench_documents(titles, series_ratio, episodes, categories), batch_size)
+    try: sync_indexes()
+    except Exception as e: app.logger.error(f"Bench index sync failed (mongomock has no partial indexes): {e}")
+    for build in (rebuild_home_snapshot, compute_rankings):
+        try: build()
+        except Exception as e: app.logger.error(f"Bench {build.__name__} failed: {e}")
+    return {"titles": titles, "categories": len(categories), "seed_s": round(time.perf_counter() - started, 2)}
+
+def seed_bench_views(movie_ids, events, hours=7 * 24, batch_size=5000):
+    """Fold `events` synthetic views into the hourly view_buckets the view flush writes: Pareto-popular titles,
+    spread evenly over the last `hours`. Returns the number of bucket documents."""
+    view_buckets_collection.delete_many({})
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(len(movie_ids))]; scale = events / sum(weights) / hours
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    batch = []; written = 0
+    for offset in range(hours):
+        hour = now - timedelta(hours=offset)
+        for movie_id, weight in zip(movie_ids, weights):
+            expected = weight * scale; views = int(expected) + (random.random() < expected % 1)
+            if not views: continue
+            batch.append({"_id": f"{movie_id}:{hour:%Y%m%d%H}", "movie_id": movie_id, "hour": hour, "views": views})
+            if len(batch) >= batch_size: view_buckets_collection.insert_many(batch, ordered=False); written += len(batch); batch = []
+    if batch: view_buckets_collection.insert_many(batch, ordered=False); written += len(batch)
+    return written
+
+def bench_rankings(movie_ids, events, runs):
+    """Seed `events` views into view_buckets, then time compute_rankings() `runs` times."""
+    started = time.perf_counter(); buckets = seed_bench_views(movie_ids, events)
+    seeded = time.perf_counter() - started; timings = []
+    for _ in range(runs):
+        started = time.perf_counter(); compute_rankings(); timings.append(time.perf_counter() - started)
+    window = sorted(timings)
+    return {"events": events, "buckets": buckets, "seed_s": round(seeded, 2), "runs": runs,
+            "p50_ms": percentile_ms(window, 0.5), "max_ms": percentile_ms(window, 1.0)}
+
+BENCH_STREAM_MODES = ("stream_seq", "stream_seek")
+
+def bench_stream(mode, files, requests_, concurrency, seed):
+    """TTFB and throughput of /stream. stream_seq plays each file start to end the way a player does (each range
+    starts where the previous response ended); stream_seek jumps to a random offset of a random file every time."""
+    ttfbs = []; statuses = Counter(); sent = [0]; lock = threading.Lock()
+    def worker(worker_index):
+        rng = random.Random(seed + worker_index); client = app.test_client(); position = None; file_id = None
+        for _ in range(requests_ // concurrency):
+            if mode == "stream_seek" or position is None or position >= len(BENCH_FILE):
+                file_id = rng.choice(files); position = 0 if mode == "stream_seq" else rng.randrange(len(BENCH_FILE))
+            start = time.perf_counter()
+            response = client.get(f"/stream/{file_id}", headers={"Range": f"bytes={position}-"}, buffered=False)
+            chunks = iter(response.response); first = next(chunks, b""); ttfb = time.perf_counter() - start
+            size = len(first) + sum(len(chunk) for chunk in chunks); response.close()
+            position += size
+            with lock: ttfbs.append(ttfb); statuses[response.status_code] += 1; sent[0] += size
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool: list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started; window = sorted(ttfbs)
+    return {"requests": len(window), "mb_per_s": round(sent[0] / elapsed / 2 ** 20, 1) if elapsed else None, "ttfb_p50_ms": percentile_ms(window, 0.5),
+            "ttfb_p95_ms": percentile_ms(window, 0.95), "ttfb_p99_ms": percentile_ms(window, 0.99), "statuses": dict(statuses), "proxy": stream_proxy.stats()}
+
+def bench_cursor_walk(query_filter, pages):
+    """Cursor tokens for one listing, collected by following next_cursor the way the Next link does (index i: page i + 1)."""
+    tokens = [None]
+    for page in range(1, pages):
+        _, pagination = get_paginated_content(query_filter, page, tokens[-1])
+        if not pagination.has_more or not pagination.next_cursor: break
+        tokens.append(pagination.next_cursor)
+    return tokens
+
+def bench_search(rng): return "GET", f"/?q={rng.choice(BENCH_WORDS)}+{rng.choice(BENCH_WORDS)}", None
+
+def bench_scenarios(ids, listings, browse_pages, deep_page):
+    """name -> callable(rng) returning (method, path, json_body).
+    `listings` maps a list URL to its cursor tokens; browse mostly follows those (Next/Prev links) within the first
+    `browse_pages` and sometimes types ?page=N. page1/deep_skip/deep_keyset compare /movies page 1 with page
+    `deep_page` under both schemes. detail_unbuffered is detail with the view buffer flushing on every view."""
+    update_ids = iter(range(10 ** 9, 2 * 10 ** 9))
+    def hot_id(rng): return ids[min(int(rng.paretovariate(1.1)) - 1, len(ids) - 1)]
+    def browse(rng):
+        path = rng.choice(["/"] + list(listings))
+        if path == "/": return "GET", path, None
+        tokens = listings[path]; index = rng.randrange(min(len(tokens), browse_pages)); joiner = "&" if "?" in path else "?"
+        if index and rng.random() < 0.8: return "GET", f"{path}{joiner}cursor={tokens[index]}", None
+        return "GET", f"{path}{joiner}page={index + 1}", None
+    movie_pages = listings["/movies"]; deep_page = min(deep_page, len(movie_pages))
+    def page1(rng): return "GET", "/movies", None
+    def deep_skip(rng): return "GET", f"/movies?page={deep_page}", None
+    def deep_keyset(rng): return "GET", f"/movies?cursor={movie_pages[deep_page - 1]}" if deep_page > 1 else "/movies", None
+    def home(rng): return "GET", "/", None
+    def detail(rng): return "GET", f"/movie/{hot_id(rng)}", None
+    def webhook(rng):
+        update_id = next(update_ids)
+        caption = f"{_bench_title(update_id)} S0{rng.randint(1, 3)}E{rng.randint(1, 20):02d} 720p" if rng.random() < 0.5 else f"{_bench_title(update_id)} {rng.randint(1990, 2024)} 1080p"
+        return "POST", "/telegram_update", {"update_id": update_id, "message": {"caption": caption, "video": {"file_id": f"bench-up-{update_id}", "file_unique_id": f"bench-uu-{update_id}"}}}
+    weighted = [browse] * 12 + [bench_search] * 2 + [detail] * 5 + [webhook]
+    return {"home": home, "browse": browse, "search": bench_search, "detail": detail, "detail_unbuffered": detail, "webhook": webhook,
+            "mixed": lambda rng: rng.choice(weighted)(rng), "page1": page1, "deep_skip": deep_skip, "deep_keyset": deep_keyset}
+
+COLD_START_PROBE = """
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app
+imported = time.perf_counter()
+if {mongomock!r}:
+    import mongomock
+    app._mongo_client = mongomock.MongoClient(); app._mongo_client_pid = os.getpid()
+response = app.app.test_client().get({path!r}, buffered=False)
+next(iter(response.response), b"")
+print(json.dumps({{"import_ms": (imported - started) * 1000, "first_byte_ms": (time.perf_counter() - started) * 1000, "status": response.status_code}}))
+"""
+
+def bench_cold_start(path, runs, mongomock_backend):
+    """Import-to-first-byte of a fresh interpreter, `runs` times; the process wall time adds interpreter startup."""
+    import subprocess
+    env = {**os.environ, "MONGO_URI": MONGO_URI, "MONGO_DB_NAME": MONGO_DB_NAME}
+    script = COLD_START_PROBE.format(root=os.path.dirname(os.path.abspath(__file__)), mongomock=mongomock_backend, path=path)
+    samples = []; statuses = Counter()
+    for _ in range(runs):
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env)
+        wall = time.perf_counter() - started
+        try: sample = json.loads(out.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError): app.logger.error(f"Cold start probe failed: {out.stderr[-500:]}"); continue
+        samples.append({**sample, "process_ms": wall * 1000}); statuses[sample["status"]] += 1
+    def p50(field): return percentile_ms(sorted(sample[field] / 1000 for sample in samples), 0.5)
+    return {"path": path, "runs": len(samples), "import_ms": p50("import_ms"), "first_byte_ms": p50("first_byte_ms"),
+            "process_ms": p50("process_ms"), "statuses": dict(statuses)}
+
+class BenchReplySizer(monitoring.CommandListener):
+    """Bench-only: BSON size and decode time of every command reply, summed per calling thread. Requests run
+    in-process on the bench worker's thread, so before/after differences attribute them to one request."""
+    def __init__(self): self._local = threading.local()
+
+    def started(self, event): pass
+    def failed(self, event): pass
+
+    def succeeded(self, event):
+        raw = encode_bson(event.reply); start = time.perf_counter(); decode_bson(raw)
+        reply_bytes, decode_seconds = self.totals()
+        self._local.totals = (reply_bytes + len(raw), decode_seconds + time.perf_counter() - start)
+
+    def totals(self): return getattr(self._local, "totals", (0, 0.0))
+
+bench_reply_sizer = BenchReplySizer()
+SERVER_TIMING_RE = re.compile(r'(\w+);dur=([\d.]+)(?:;desc="(\d+) calls")?')
+WRITE_COMMANDS = ("insert", "update", "delete", "findAndModify")
+
+def _bench_route_stats(entries):
+    """Per-endpoint latency, render time (from Server-Timing), DB round trips and bytes."""
+    stats = {}
+    for route, rows in sorted(entries.items()):
+        latencies = sorted(row['seconds'] for row in rows); renders = sorted(row['render'] for row in rows if row['render'] is not None)
+        stats[route] = {"requests": len(rows), "p50_ms": percentile_ms(latencies, 0.5), "p99_ms": percentile_ms(latencies, 0.99),
+                        "render_p50_ms": percentile_ms(renders, 0.5), "render_p99_ms": percentile_ms(renders, 0.99),
+                        "db_calls_per_request": round(sum(row['db_calls'] for row in rows) / len(rows), 2),
+                        "response_kb": round(sum(row['response_bytes'] for row in rows) / len(rows) / 1024, 1),
+                        "db_reply_kb": round(sum(row['reply_bytes'] for row in rows) / len(rows) / 1024, 1),
+                        "bson_decode_ms": round(sum(row['decode'] for row in rows) / len(rows) * 1000, 3)}
+    return stats
+
+def run_bench_scenario(make_request, requests_, concurrency, seed):
+    latencies = []; statuses = Counter(); routes = {}; lock = threading.Lock()
+    url_adapter = app.url_map.bind("localhost")
+    def db_totals(names=None):
+        return sum(count for name, count in (mongo_command_timer.commands + mongo_command_timer.failures).items() if names is None or name in names)
+    db_before = db_totals(); writes_before = db_totals(WRITE_COMMANDS)
+    def worker(worker_index):
+        rng = random.Random(seed + worker_index); client = app.test_client()
+        for _ in range(requests_ // concurrency):
+            method, path, body = make_request(rng)
+            try: route = url_adapter.match(urlparse(path).path, method=method)[0]
+            except Exception: route = "<unmatched>"
+            reply_before = bench_reply_sizer.totals()
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            data = response.get_data(); elapsed = time.perf_counter() - start
+            reply_after = bench_reply_sizer.totals()
+            response.close()  # after timing: call_on_close work (view flush) happens once the client has its answer
+            phases = {phase: (float(ms), int(calls or 0)) for phase, ms, calls in SERVER_TIMING_RE.findall(response.headers.get('Server-Timing', ''))}
+            row = {"seconds": elapsed, "render": phases["render"][0] / 1000 if "render" in phases else None, "db_calls": phases.get("db", (0, 0))[1],
+                   "response_bytes": len(data), "reply_bytes": reply_after[0] - reply_before[0], "decode": reply_after[1] - reply_before[1]}
+            with lock: latencies.append(elapsed); statuses[response.status_code] += 1; routes.setdefault(route, []).append(row)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool: list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    db_ops = db_totals() - db_before; write_ops = db_totals(WRITE_COMMANDS) - writes_before
+    window = sorted(latencies)
+    return {"requests": len(window), "rps": round(len(window) / elapsed, 1) if elapsed else None, "p50_ms": percentile_ms(window, 0.5),
+            "p95_ms": percentile_ms(window, 0.95), "p99_ms": percentile_ms(window, 0.99), "db_ops_per_request": round(db_ops / len(window), 2) if window else None,
+            "write_ops_per_s": round(write_ops / elapsed, 1) if elapsed else None,
+            "errors": sum(count for status, count in statuses.items() if status >= 500), "statuses": dict(statuses), "routes": _bench_route_stats(routes)}
+
+def bench_drain_jobs():
+    """Run every due job; returns (jobs, seconds)."""
+    started = time.perf_counter(); drained = 0
+    while True:
+        processed = run_pending_jobs(time_budget=None, max_jobs=500); drained += processed
+        if not processed: return drained, time.perf_counter() - started
+
+def bench_series_ingest(episodes, seasons=5):
+    """Upload `episodes` SxxEyy videos of one new series through the webhook, then drain the queue: ack latency,
+    ingest throughput, and what the series document and the coalesced channel post look like afterwards."""
+    global SERIES_NOTIFY_WINDOW
+    title = "Bench Saga " + "".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8)).title()
+    per_season = math.ceil(episodes / seasons); base = int(time.time() * 1000) * 1000
+    client = app.test_client(); acks = []
+    window, SERIES_NOTIFY_WINDOW = SERIES_NOTIFY_WINDOW, 0  # the coalesced post is due as soon as the burst is in
+    try:
+        for n in range(episodes):
+            caption = f"{title} S{n // per_season + 1:02d}E{n % per_season + 1:02d} 720p"
+            body = {"update_id": base + n, "message": {"caption": caption, "video": {"file_id": f"bench-ep-{base + n}", "file_unique_id": f"bench-epu-{base + n}"}}}
+            start = time.perf_counter(); response = client.post("/telegram_update", json=body); acks.append(time.perf_counter() - start); response.close()
+        jobs, drain_seconds = bench_drain_jobs()
+    finally: SERIES_NOTIFY_WINDOW = window
+    series = movies.find_one({"series_key": series_key_for(title)}, {"episodes": 1, "season_summary": 1}) or {}
+    window = sorted(acks)
+    return {"episodes": episodes, "ack_p50_ms": percentile_ms(window, 0.5), "ack_p99_ms": percentile_ms(window, 0.99), "jobs": jobs,
+            "drain_s": round(drain_seconds, 2), "episodes_per_s": round(episodes / drain_seconds, 1) if drain_seconds else None,
+            "stored_episodes": len(series.get('episodes', [])), "seasons": len(series.get('season_summary') or {}),
+            "channel_posts": outbox_collection.count_documents({"movie_id": series['_id']}) if series else 0}
+
+def bench_search_scaling(sizes, requests_, concurrency, seed, series_ratio, episodes):
+    """Grow the catalogue to each size in turn and replay the search scenario; latency should stay flat."""
+    global count_provider
+    categories = [doc['name'] for doc in categories_collection.find({}, {"name": 1})]
+    results = {}
+    for size in sizes:
+        current = movies.count_documents({})
+        if size > current: insert_bench_documents(bench_documents(size - current, series_ratio, episodes, categories, start=current))
+        count_provider = CountProvider()  # totals cached at the previous size would short-circuit the text count
+        results[size] = run_bench_scenario(bench_search, requests_, concurrency, seed)
+    return results
+
+def run_benchmark(argv):
+    """python app.py bench [--titles N] [--requests N] [--concurrency N] [--scenarios a,b] [--out report.json] ...
+    Seeds a throwaway database (never MONGO_DB_NAME itself) and replays traffic through the WSGI app in-process.
+    Each request scenario also reports per-route render time, DB round trips, response bytes and DB reply bytes."""
+    global MONGO_URI, MONGO_DB_NAME, TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID, WEBSITE_URL, TMDB_API_KEY, JOB_INLINE_DRAIN, page_cache, stream_proxy, _mongo_client, _mongo_client_pid
+    import argparse, shutil, subprocess
+    parser = argparse.ArgumentParser(prog="app.py bench")
+    parser.add_argument("--uri", help="MongoDB to seed and benchmark (default: MONGO_URI, which must then be set explicitly)")
+    parser.add_argument("--db", default=f"{MONGO_DB_NAME}_bench")
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock instead of MONGO_URI (no $unionWith/text search)")
+    parser.add_argument("--titles", type=int, default=1000)
+    parser.add_argument("--series-ratio", type=float, default=0.2)
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--categories", type=int, default=7)
+    parser.add_argument("--no-seed", action="store_true", help="reuse the catalogue from a previous run")
+    parser.add_argument("--requests", type=int, default=500, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--scenarios", default="home,browse,search,detail,detail_unbuffered,webhook,mixed,page1,deep_skip,deep_keyset,"
+                                                "stream_seq,stream_seek,ingest_series,search_scaling")
+    parser.add_argument("--ingest-episodes", type=int, default=500, help="episodes ingest_series uploads for one series")
+    parser.add_argument("--search-sizes", default="10000,100000", help="catalogue sizes search_scaling grows to, in order (runs last)")
+    parser.add_argument("--stream-files", type=int, default=20, help="distinct file_ids the stream_* scenarios play")
+    parser.add_argument("--pages", type=int, default=50, help="list pages browse walks per listing")
+    parser.add_argument("--deep-page", type=int, default=500, help="/movies page deep_skip/deep_keyset fetch (needs titles >= page * 20)")
+    parser.add_argument("--page-cache", action="store_true", help="keep the response cache on (default: measure uncached cost)")
+    parser.add_argument("--stub-latency-ms", type=float, default=0)
+    parser.add_argument("--view-events", type=int, default=10_000_000, help="synthetic views folded into view_buckets before timing compute_rankings (0 skips)")
+    parser.add_argument("--rankings-runs", type=int, default=3)
+    parser.add_argument("--cold-starts", type=int, default=5, help="fresh interpreters timed from import to first byte (0 skips)")
+    parser.add_argument("--cold-start-path", default="/movies")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out")
+    args = parser.parse_args(argv)
+    if args.db == os.environ.get("MONGO_DB_NAME", "movie_db"): parser.error("refusing to benchmark against the live database; pick another --db")
+    if not args.mongomock and not (args.uri or os.environ.get("MONGO_URI")):
+        parser.error("pass --uri (e.g. mongodb://localhost:27017) or set MONGO_URI; the built-in default points at the production cluster")
+    if args.uri: MONGO_URI = args.uri
+
+    MONGO_DB_NAME = args.db
+    if args.mongomock:
+        import mongomock
+        _mongo_client = mongomock.MongoClient(); _mongo_client_pid = os.getpid()
+    TELEGRAM_BOT_TOKEN = TELEGRAM_BOT_TOKEN or "bench:token"; TMDB_API_KEY = TMDB_API_KEY or "bench"
+    TELEGRAM_CHANNEL_ID = TELEGRAM_CHANNEL_ID or "@bench"; WEBSITE_URL = WEBSITE_URL or "https://bench.invalid"
+    monitoring.register(bench_reply_sizer)  # before the client exists: listeners attach at MongoClient creation
+    if not args.page_cache: page_cache = None
+    JOB_INLINE_DRAIN = False  # webhook latency is the ack; queued work is drained (and timed) after each scenario
+    logging.getLogger("request_log").disabled = True
+    stubs = install_bench_stubs(args.stub_latency_ms / 1000)
+    random.seed(args.seed)
+
+    seed_report = seed_bench_catalogue(args.titles, args.series_ratio, args.episodes, args.categories) if not args.no_seed else None
+    ids = [str(doc['_id']) for doc in movies.find({}, {"_id": 1}).sort("view_count", -1).limit(10000)]
+    categories = [doc['name'] for doc in categories_collection.find({}, {"name": 1})]
+    listings = {"/movies": bench_cursor_walk({"type": "movie"}, max(args.pages, args.deep_page)), "/series": bench_cursor_walk({"type": "series"}, args.pages)}
+    for name in categories: listings[f"/category?name={quote(name)}"] = bench_cursor_walk({"categories": name}, args.pages)
+    if len(listings["/movies"]) < args.deep_page: print(f"/movies has only {len(listings['/movies'])} pages; deep_* use the last one", file=sys.stderr)
+    scenarios = bench_scenarios(ids, listings, args.pages, args.deep_page)
+
+    stream_files = [f"bench-file-{i}" for i in range(args.stream_files)]
+
+    results = {}
+    for name in args.scenarios.split(","):
+        if name in BENCH_STREAM_MODES:
+            stream_proxy = StreamProxy()  # fresh counters and a cold segment cache per scenario
+            stream_proxy.cache.root = os.path.join(STREAM_CACHE_DIR, f"bench-{os.getpid()}-{name}")
+            results[name] = bench_stream(name, stream_files, args.requests, args.concurrency, args.seed)
+            shutil.rmtree(stream_proxy.cache.root, ignore_errors=True)
+            print(f"{name:>8}: {results[name]['mb_per_s']} MiB/s  ttfb p50 {results[name]['ttfb_p50_ms']} ms  "
+                  f"p95 {results[name]['ttfb_p95_ms']} ms  p99 {results[name]['ttfb_p99_ms']} ms", file=sys.stderr)
+            continue
+        if name == "ingest_series":
+            results[name] = ingest = bench_series_ingest(args.ingest_episodes)
+            print(f"{name:>8}: {ingest['episodes']} episodes  ack p99 {ingest['ack_p99_ms']} ms  {ingest['episodes_per_s']} episodes/s  "
+                  f"stored {ingest['stored_episodes']} in {ingest['seasons']} seasons  posts {ingest['channel_posts']}", file=sys.stderr)
+            continue
+        if name == "search_scaling":
+            if args.mongomock: print(f"{name:>8}: skipped, mongomock has no $text", file=sys.stderr); continue
+            results[name] = bench_search_scaling([int(size) for size in args.search_sizes.split(",")], args.requests, args.concurrency,
+                                                 args.seed, args.series_ratio, args.episodes)
+            for size, result in results[name].items():
+                print(f"{name:>8}: {size} titles  p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms", file=sys.stderr)
+            continue
+        flush_size = view_counter.flush_size
+        if name == "detail_unbuffered": view_counter.flush_size = 1  # one $inc write per view, like the pre-buffer read path
+        try: results[name] = run_bench_scenario(scenarios[name], args.requests, args.concurrency, args.seed)
+        finally: view_counter.flush_size = flush_size
+        if args.mongomock:  # mongomock emits no command events
+            results[name]["db_ops_per_request"] = results[name]["write_ops_per_s"] = None
+            for route in results[name]["routes"].values(): route["db_calls_per_request"] = route["db_reply_kb"] = route["bson_decode_ms"] = None
+        if name in ("webhook", "mixed"):
+            drained, drain_seconds = bench_drain_jobs()
+            results[name]["jobs_drained"] = drained; results[name]["jobs_drain_s"] = round(drain_seconds, 2)
+            results[name]["jobs_per_s"] = round(drained / drain_seconds, 1) if drain_seconds else None
+        print(f"{name:>8}: {results[name]['rps']} req/s  p50 {results[name]['p50_ms']} ms  p95 {results[name]['p95_ms']} ms  "
+              f"p99 {results[name]['p99_ms']} ms  db/req {results[name]['db_ops_per_request']}  writes/s {results[name]['write_ops_per_s']}  "
+              f"errors {results[name]['errors']}", file=sys.stderr)
+
+    rankings = None
+    if args.view_events:
+        rankings = bench_rankings([ObjectId(movie_id) for movie_id in ids], args.view_events, args.rankings_runs)
+        print(f"rankings: {rankings['events']} views in {rankings['buckets']} buckets  compute_rankings p50 {rankings['p50_ms']} ms  "
+              f"max {rankings['max_ms']} ms", file=sys.stderr)
+    cold_start = bench_cold_start(args.cold_start_path, args.cold_starts, args.mongomock) if args.cold_starts else None
+    if cold_start: print(f"cold start {cold_start['path']}: import {cold_start['import_ms']} ms  first byte {cold_start['first_byte_ms']} ms  "
+                         f"process {cold_start['process_ms']} ms", file=sys.stderr)
+
+    try: commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError: commit = None
+    report = {"commit": commit, "created_at": datetime.utcnow().isoformat() + "Z", "backend": "mongomock" if args.mongomock else "mongodb",
+              "params": {k: v for k, v in vars(args).items() if k != "out"}, "seed": seed_report, "scenarios": results, "rankings": rankings, "cold_start": cold_start,
+              "routes": route_metrics.stats(), "mongo": mongo_command_timer.stats(), "stub_calls": dict(stubs.calls)}
+    output = json.dumps(report, indent=2, default=str)
+    if args.out:
+        with open(args.out, "w") as f: f.write(output + "\n")
+    else: print(output)
+    return report
 
 
 if __name__ == "__main__":
-    port = int(os.environ.get('PORT', 3000))
-    app.run(debug=True, host='0.0.0.0', port=port)
+    if sys.argv[1:2] == ["migrate"]:
+        run_migrations()
+    elif sys.argv[1:2] == ["trending"]:
+        print(f"Rankings computed: {compute_rankings()}")
+        rebuild_home_snapshot(); catalogue_generation.bump()
+    elif sys.argv[1:2] == ["home"]:
+        # python app.py home [rebuild | check]
+        if sys.argv[2:3] == ["check"]:
+            mismatches = check_home_snapshot()
+            print("Home snapshot is consistent." if not mismatches else f"Stale shelves: {', '.join(mismatches)}")
+            sys.exit(1 if mismatches else 0)
+        snapshot = rebuild_home_snapshot()
+        print(f"Home snapshot rebuilt: {len(snapshot['shelves'])} shelves.")
+    elif sys.argv[1:2] == ["indexes"]:
+        # python app.py indexes [sync [--prune] | verify]
+        if sys.argv[2:3] == ["verify"]:
+            results = verify_query_plans()
+            for label, ok, stages in results: print(f"{'OK  ' if ok else 'FAIL'} {label}: {' <- '.join(stages)}")
+            sys.exit(0 if all(ok for _, ok, _ in results) else 1)
+        for collection_name, name, action in sync_indexes(prune="--prune" in sys.argv):
+            print(f"{action:>10}  {collection_name}.{name}")
+    elif sys.argv[1:2] == ["catalogue"]:
+        run_catalogue_cli(sys.argv[2:])
+    elif sys.argv[1:2] == ["bench"]:
+        run_benchmark(sys.argv[2:])
+    elif sys.argv[1:2] == ["worker"]:
+        enqueue_pending_enrichment(limit=0)
+        run_worker()
+    else:
+        port = int(os.environ.get('PORT', 3000))
+        app.run(debug=True, host='0.0.0.0', port=port)
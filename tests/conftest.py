@@ -0,0 +1,60 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubServer:
+    """Local HTTP server standing in for api.telegram.org / api.themoviedb.org.
+    script(path, *responses) replays the responses in order (the last one repeats). A response is a dict with
+    status / headers / json / body / delay, {"drop": True} to hang up after reading the request, or a callable
+    taking the request handler and returning such a dict."""
+    def __init__(self):
+        self.scripts = {}; self.hits = Counter(); self.requests = []; self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def log_message(self, *args): pass
+            def do_GET(self): stub._serve(self)
+            def do_POST(self): stub._serve(self)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler); self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def script(self, path, *responses): self.scripts[path] = list(responses)
+
+    def _serve(self, handler):
+        path = handler.path.split("?")[0]
+        length = int(handler.headers.get("Content-Length") or 0)
+        if length: handler.rfile.read(length)
+        with self._lock:
+            self.hits[path] += 1; self.requests.append((handler.command, path, dict(handler.headers)))
+            script = self.scripts.get(path) or [{"status": 404}]
+            spec = script.pop(0) if len(script) > 1 else script[0]
+        if callable(spec): spec = spec(handler)
+        if spec.get("delay"): time.sleep(spec["delay"])
+        if spec.get("drop"):
+            handler.close_connection = True; return
+        body = json.dumps(spec["json"]).encode() if "json" in spec else spec.get("body", b"")
+        handler.send_response(spec.get("status", 200))
+        for name, value in spec.get("headers", {}).items(): handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body))); handler.end_headers()
+        handler.wfile.write(body)
+
+    def close(self): self.httpd.shutdown(); self.httpd.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
@@ -0,0 +1,81 @@
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app.OutboundHTTP, "_backoff", staticmethod(lambda attempt: 0))
+    return app.OutboundHTTP()
+
+
+def test_429_waits_for_telegram_retry_after(stub_server, client):
+    stub_server.script("/sendMessage", {"status": 429, "json": {"ok": False, "parameters": {"retry_after": 0.3}}}, {"json": {"ok": True}})
+    started = time.monotonic()
+    res = client.post(f"{stub_server.url}/sendMessage", json={"text": "hi"})
+    assert res.status_code == 200 and stub_server.hits["/sendMessage"] == 2
+    assert time.monotonic() - started >= 0.3
+
+
+def test_429_honors_retry_after_header(stub_server, client):
+    stub_server.script("/3/movie/1", {"status": 429, "headers": {"Retry-After": "0.2"}}, {"json": {"id": 1}})
+    started = time.monotonic()
+    assert client.get(f"{stub_server.url}/3/movie/1").json() == {"id": 1}
+    assert time.monotonic() - started >= 0.2
+
+
+def test_429_longer_than_max_wait_is_returned(stub_server, client, monkeypatch):
+    monkeypatch.setattr(app, "HTTP_MAX_RETRY_WAIT", 1)
+    stub_server.script("/sendMessage", {"status": 429, "json": {"ok": False, "parameters": {"retry_after": 30}}})
+    assert client.post(f"{stub_server.url}/sendMessage").status_code == 429
+    assert stub_server.hits["/sendMessage"] == 1
+
+
+def test_post_is_not_retried_once_sent(stub_server, client):
+    stub_server.script("/sendMessage", {"drop": True})
+    with pytest.raises(requests.ConnectionError):
+        client.post(f"{stub_server.url}/sendMessage", json={"text": "hi"})
+    assert stub_server.hits["/sendMessage"] == 1
+    stub_server.script("/sendPhoto", {"status": 502}, {"json": {"ok": True}})
+    assert client.post(f"{stub_server.url}/sendPhoto").status_code == 502
+    assert stub_server.hits["/sendPhoto"] == 1
+
+
+def test_get_is_retried_after_a_dropped_connection(stub_server, client):
+    stub_server.script("/getFile", {"drop": True}, {"status": 502}, {"json": {"ok": True}})
+    assert client.get(f"{stub_server.url}/getFile").status_code == 200
+    assert stub_server.hits["/getFile"] == 3
+
+
+def test_post_is_retried_when_the_connection_never_opened(client):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0)); port = sock.getsockname()[1]  # closed again before the request: refused
+    url = f"http://127.0.0.1:{port}/sendMessage"
+    with pytest.raises(requests.ConnectionError):
+        client.post(url, retries=2)
+    assert client.client(url).retries == 2
+
+
+def test_half_open_allows_a_single_probe(stub_server, client, monkeypatch):
+    monkeypatch.setattr(app, "HTTP_BREAKER_THRESHOLD", 2)
+    monkeypatch.setattr(app, "HTTP_BREAKER_COOLDOWN", 0.2)
+    url = f"{stub_server.url}/3/movie/1"
+    stub_server.script("/3/movie/1", {"status": 503}, {"status": 503}, {"json": {"id": 1}, "delay": 0.5})
+    for _ in range(2): assert client.get(url, retries=0).status_code == 503
+    with pytest.raises(app.CircuitOpenError): client.get(url, retries=0)
+    time.sleep(0.25)
+
+    probe = threading.Thread(target=lambda: client.get(url, retries=0)); probe.start()
+    time.sleep(0.1)
+    assert client.client(url).stats()["circuit"] == "half-open"
+    for _ in range(5):
+        with pytest.raises(app.CircuitOpenError): client.get(url, retries=0)
+    probe.join()
+    assert stub_server.hits["/3/movie/1"] == 3
+    assert client.client(url).stats()["circuit"] == "closed"
+    assert client.get(url, retries=0).status_code == 200
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+import app
+
+TEST_MONGO_URI = os.environ.get("TEST_MONGO_URI", "mongodb://localhost:27017")
+TEST_DB_NAME = "movie_db_query_plans"
+
+
+def _reset_collections():
+    for value in vars(app).values():
+        if isinstance(value, app.LazyCollection): value._collection = None
+
+
+@pytest.fixture(scope="module")
+def indexed_catalogue():
+    client = MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=500)
+    try: client.admin.command("ping")
+    except PyMongoError: pytest.skip(f"no mongod at {TEST_MONGO_URI} (set TEST_MONGO_URI)")
+    saved = app._mongo_client, app._mongo_client_pid, app.MONGO_DB_NAME
+    app._mongo_client, app._mongo_client_pid, app.MONGO_DB_NAME = client, os.getpid(), TEST_DB_NAME
+    _reset_collections()
+    client.drop_database(TEST_DB_NAME)
+    app.movies.insert_many(list(app.bench_documents(2000, 0.2, 10, ["Trending", "Action", "Series"])))
+    app.sync_indexes()
+    yield
+    client.drop_database(TEST_DB_NAME)
+    app._mongo_client, app._mongo_client_pid, app.MONGO_DB_NAME = saved
+    _reset_collections()
+
+
+@pytest.mark.parametrize("label,collection_name,query", app.query_shapes(), ids=[shape[0] for shape in app.query_shapes()])
+def test_query_shape_uses_an_index(indexed_catalogue, label, collection_name, query):
+    ok, stages = app.explain_query_shape(collection_name, query)
+    assert ok, f"{label}: {stages}"
+    assert "COLLSCAN" not in stages
+
+
+def test_query_shapes_match_the_routes():
+    cursor = {"updated_at": app.datetime(2024, 1, 1), "_id": app.ObjectId(), "forward": True, "page": 3}
+    token = app.encode_cursor({"updated_at": cursor["updated_at"], "_id": cursor["_id"]}, "next", 3)
+    assert app.keyset_query({"type": "movie"}, app.decode_cursor(token)) == app.keyset_query({"type": "movie"}, cursor)
+    pipeline = app.home_pipeline(["Trending"])
+    assert [stage for stage in pipeline if "$unionWith" in stage][-1]["$unionWith"]["pipeline"][0] == {"$match": {"categories": "Trending"}}
+    assert app.search_fallback_query("a.b")[0] == {"title": {"$regex": "^a\\.b", "$options": "i"}}
+
+
+def test_plan_stages_walks_union_with_and_skips_rejected_plans():
+    explained = {"command": {"pipeline": [{"$sort": {"updated_at": -1}}]}, "stages": [
+        {"$cursor": {"queryPlanner": {"winningPlan": {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}},
+                                      "rejectedPlans": [{"stage": "COLLSCAN"}]}}},
+        {"$unionWith": {"coll": "movies", "pipeline": [{"$cursor": {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}}, {"$sort": {"sortKey": {"x": 1}}}]}}]}
+    assert app._plan_stages(explained) == ["LIMIT", "FETCH", "IXSCAN", "COLLSCAN", "SORT"]
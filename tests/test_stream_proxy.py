@@ -0,0 +1,80 @@
+import re
+
+import pytest
+
+import app
+
+FILE = bytes(range(256)) * 2000  # 512000 bytes
+SEGMENT = 64 * 1024
+
+
+def serve_file(handler):
+    match = re.match(r"bytes=(\d+)-(\d*)$", handler.headers.get("Range") or "")
+    if not match: return {"body": FILE, "headers": {"Content-Type": "video/mp4"}}
+    start = int(match.group(1)); end = min(int(match.group(2)) if match.group(2) else len(FILE) - 1, len(FILE) - 1)
+    if start >= len(FILE): return {"status": 416, "headers": {"Content-Range": f"bytes */{len(FILE)}"}}
+    return {"status": 206, "body": FILE[start:end + 1], "headers": {"Content-Type": "video/mp4", "Content-Range": f"bytes {start}-{end}/{len(FILE)}"}}
+
+
+@pytest.fixture
+def proxy(stub_server, monkeypatch, tmp_path):
+    """StreamProxy on /stream whose upstream (the real OutboundHTTP client) is redirected to the stub server."""
+    stub_server.script("/file/botTEST/videos/file_1.mp4", serve_file)
+    real_request = app.http_client.request
+    monkeypatch.setattr(app.http_client, "request", lambda method, url, **kwargs: real_request(method, url.replace("https://api.telegram.org", stub_server.url), **kwargs))
+    monkeypatch.setattr(app, "TELEGRAM_BOT_TOKEN", "TEST")
+    monkeypatch.setattr(app.stream_resolver, "resolve_path", lambda file_id: "videos/file_1.mp4")
+    proxy = app.StreamProxy(segment_size=SEGMENT)
+    proxy.cache = app.SegmentCache(root=str(tmp_path), hot_hits=2)
+    monkeypatch.setattr(app, "stream_proxy", proxy)
+    return proxy
+
+
+@pytest.fixture
+def client(): return app.app.test_client()
+
+
+def upstream_ranges(stub_server): return [headers.get("Range") for _, path, headers in stub_server.requests if path.startswith("/file/")]
+
+
+def test_no_range_streams_the_whole_file_as_200(proxy, client, stub_server):
+    response = client.get("/stream/FID")
+    assert response.status_code == 200 and response.data == FILE
+    assert "Content-Range" not in response.headers and response.headers["Accept-Ranges"] == "bytes"
+    assert upstream_ranges(stub_server) == [None]
+    assert proxy.slots._value == app.STREAM_MAX_UPSTREAM
+
+
+def test_open_range_is_capped_at_the_segment(proxy, client):
+    response = client.get("/stream/FID", headers={"Range": "bytes=100-"})
+    assert response.status_code == 206 and response.data == FILE[100:SEGMENT]
+    assert response.headers["Content-Range"] == f"bytes 100-{SEGMENT - 1}/{len(FILE)}"
+
+
+def test_closed_range_and_tail(proxy, client):
+    response = client.get("/stream/FID", headers={"Range": "bytes=5-9"})
+    assert response.status_code == 206 and response.data == FILE[5:10]
+    response = client.get("/stream/FID", headers={"Range": f"bytes={len(FILE) - 10}-"})
+    assert response.data == FILE[-10:] and response.headers["Content-Range"] == f"bytes {len(FILE) - 10}-{len(FILE) - 1}/{len(FILE)}"
+
+
+def test_range_past_the_end_is_416(proxy, client):
+    response = client.get("/stream/FID", headers={"Range": f"bytes={len(FILE)}-"})
+    assert response.status_code == 416 and response.headers["Content-Range"] == f"bytes */{len(FILE)}"
+
+
+def test_hot_segments_are_served_from_disk(proxy, client, stub_server):
+    for _ in range(3):
+        response = client.get("/stream/FID", headers={"Range": f"bytes={SEGMENT + 10}-"})
+        assert response.data == FILE[SEGMENT + 10:2 * SEGMENT]
+    # 1st: cold, exact range; 2nd: hot, fetches the whole segment into the cache; 3rd: disk
+    assert upstream_ranges(stub_server) == [f"bytes={SEGMENT + 10}-{2 * SEGMENT - 1}", f"bytes={SEGMENT}-{2 * SEGMENT - 1}"]
+    assert proxy.cache.hits == 1
+
+
+def test_expired_file_path_is_resolved_again(proxy, client, stub_server, monkeypatch):
+    stub_server.script("/file/botTEST/videos/file_1.mp4", {"status": 404}, serve_file)
+    invalidated = []
+    monkeypatch.setattr(app.stream_resolver, "invalidate", invalidated.append)
+    response = client.get("/stream/FID", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206 and response.data == FILE[:10] and invalidated == ["FID"]